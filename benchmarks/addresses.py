@@ -0,0 +1,163 @@
+# coding: utf-8
+"""
+Checks `CanadianPerson.clean_address` against a corpus of addresses and the
+output of its previous implementation, which ran one regular expression per
+province or territory name, and compares their throughput.
+
+    python benchmarks/addresses.py
+
+To regenerate the corpus with the previous implementation:
+
+    python benchmarks/addresses.py --write
+"""
+
+import argparse
+import csv
+import logging
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import CanadianPerson, clean_string, province_or_territory_abbreviations  # noqa: E402
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "addresses.csv")
+
+
+def clean_address_before(s):
+    """
+    `CanadianPerson.clean_address` before it matched the last line of the address once.
+    """
+    s = re.sub(r"\b[A-Z][O0-9][A-Z]\s?[O0-9][A-Z][O0-9]\b", lambda x: x.group(0).replace("O", "0"), clean_string(s))
+    for k, v in province_or_territory_abbreviations().items():
+        s = re.sub(
+            r"[,\n ]+" r"\(?" + k + r"\)?" r"(?=(?:[,\n ]+Canada)?(?:[,\n ]+[A-Z][0-9][A-Z]\s?[0-9][A-Z][0-9])?\Z)",
+            " " + v,
+            s,
+        )
+    return re.sub(
+        r"[,\n ]+" r"([A-Z]{2})" r"(?:[,\n ]+Canada)?" r"[,\n ]+([A-Z][0-9][A-Z])\s?([0-9][A-Z][0-9])" r"\Z",
+        r" \1  \2 \3",
+        s,
+    )
+
+
+def generate(size=2000, seed=1):
+    """
+    Returns addresses that mix English and French names, abbreviations,
+    parenthesized names, "Canada", O/0 typos in postal codes and separators.
+    """
+    rng = random.Random(seed)
+    names = sorted(province_or_territory_abbreviations().items())
+    streets = [
+        "123 Main St",
+        "City Hall\n1 Queen St W",
+        "PO Box 35",
+        "Room 200, Legislative Building",
+        "Suite 1, 50 O'Connor St",
+        "",
+        "Hôtel de ville\n2 rue Notre-Dame",
+    ]
+    cities = ["Toronto", "Québec", "St. John's", "Ottawa", "", "Charlottetown", "Whitehorse", "MONTREAL"]
+    separators = [", ", "\n", " ", ",", " ,  ", ",\n"]
+
+    def postal_code():
+        letters = "ABCEGHJKLMNPRSTVXY"
+        digits = "0123456789O"
+        return "".join(
+            [
+                rng.choice(letters),
+                rng.choice(digits),
+                rng.choice(letters),
+                rng.choice([" ", "", "  "]),
+                rng.choice(digits),
+                rng.choice(letters),
+                rng.choice(digits),
+            ]
+        )
+
+    addresses = [
+        "",
+        "Ottawa ON  K1A 0A6",
+        "House of Commons\nOttawa ON  K1A 0A6",
+        "Foo, ON, Ontario K1A 0A6",
+        "Ontario K1A 0A6",
+        "Foo, PEI",
+        "Foo\nPrince Edward Island\nCanada",
+        "Foo, Québec (Québec) G1R 4Y5",
+        "Nova Scotia",
+    ]
+    for _ in range(size):
+        parts = [part for part in (rng.choice(streets), rng.choice(cities)) if part]
+        r = rng.random()
+        if r < 0.5:
+            name = rng.choice(names)[0]
+            parts.append("({})".format(name) if rng.random() < 0.1 else name)
+        elif r < 0.8:
+            parts.append(rng.choice([abbreviation for _, abbreviation in names] + ["XX", "Ont."]))
+        if rng.random() < 0.3:
+            parts.append("Canada")
+        if rng.random() < 0.8:
+            parts.append(postal_code())
+        address = parts[0] if parts else ""
+        for part in parts[1:]:
+            address += rng.choice(separators) + part
+        if rng.random() < 0.05:
+            address += rng.choice([" ", "\n", ",", " Canada"])
+        addresses.append(address)
+    return addresses
+
+
+def throughput(function, addresses, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for address in addresses:
+            function(address)
+    return repeat * len(addresses) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--write", action="store_true", help="regenerate the corpus")
+    args = parser.parse_args()
+
+    # Don't log warnings about postal codes outside their province or territory.
+    logging.disable(logging.WARNING)
+
+    if args.write:
+        with open(CORPUS_PATH, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["address", "expected"])
+            for address in generate():
+                writer.writerow([address, clean_address_before(address)])
+        print("Wrote {}".format(CORPUS_PATH))
+        return
+
+    with open(CORPUS_PATH, newline="") as f:
+        rows = list(csv.DictReader(f))
+
+    def clean_address(s):
+        return CanadianPerson.clean_address(None, s)
+
+    mismatches = [row for row in rows if clean_address(row["address"]) != row["expected"]]
+    for row in mismatches[:10]:
+        print("{!r}: expected {!r}, got {!r}".format(row["address"], row["expected"], clean_address(row["address"])))
+
+    addresses = [row["address"] for row in rows]
+    print(
+        "{} addresses, {} mismatches. Before: {:.0f} addresses/s, after: {:.0f} addresses/s".format(
+            len(rows),
+            len(mismatches),
+            throughput(clean_address_before, addresses),
+            throughput(clean_address, addresses),
+        )
+    )
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
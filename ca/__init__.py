@@ -1,10 +1,9 @@
 # coding: utf-8
 from datetime import datetime
 
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
-from utils import CanadianJurisdiction
+from utils import CanadianJurisdiction, get_division
 
 
 class Canada(CanadianJurisdiction):
@@ -35,7 +34,7 @@ class Canada(CanadianJurisdiction):
         upper = Organization("Senate", classification="upper", parent_id=parliament)
         lower = Organization("House of Commons", classification="lower", parent_id=parliament)
 
-        for division in Division.get(self.division_id).children("ed"):
+        for division in get_division(self.division_id).children("ed"):
             if division.attrs.get("validFrom") and division.attrs["validFrom"] <= datetime.now().strftime("%Y-%m-%d"):
                 lower.add_post(role="MP", label=division.name, division_id=division.id)
 
@@ -26,7 +26,15 @@ class CanadaPersonScraper(CanadianScraper):
 
     def scrape_people(self, rows, gender):
         assert len(rows), "No members found"
+        urls = []
         for row in rows:
+            province = row.xpath('.//div[@class="ce-mip-mp-province"][1]')[0].text_content()
+            url = row.xpath('.//a[@class="ce-mip-mp-tile"]/@href')[0]
+            if province == "Québec":
+                url = url.replace("/en/", "/fr/")
+            urls.append(url)
+
+        for row, (url, mp_page) in zip(rows, self.lxmlize_many(urls)):
             name = row.xpath('.//div[@class="ce-mip-mp-name"][1]')[0].text_content()
             constituency = row.xpath('.//div[@class="ce-mip-mp-constituency"][1]')[0].text_content()
             constituency = constituency.replace("–", "—")  # n-dash, m-dash
@@ -37,12 +45,6 @@ class CanadaPersonScraper(CanadianScraper):
 
             party = row.xpath('.//div[@class="ce-mip-mp-party"][1]')[0].text_content()
 
-            url = row.xpath('.//a[@class="ce-mip-mp-tile"]/@href')[0]
-
-            if province == "Québec":
-                url = url.replace("/en/", "/fr/")
-
-            mp_page = self.lxmlize(url)
             email = self.get_email(mp_page, '//*[@id="contact"]/div/p/a', error=False)
 
             photo = mp_page.xpath('.//div[@class="ce-mip-mp-profile-container"]//img/@src')[0]
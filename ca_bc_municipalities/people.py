@@ -1,16 +1,16 @@
 import re
 
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
 from utils import CanadianPerson as Person
-from utils import CanadianScraper
+from utils import CanadianScraper, division_name_resolver, get_division
 
 LIST_PAGE = "https://www.civicinfo.bc.ca/people"
 
 
 class BritishColumbiaMunicipalitiesPersonScraper(CanadianScraper):
     birth_date = 1900
+    checkpoint_attributes = ("birth_date", "processed_ids", "processed_divisions")
 
     def scrape(self):
         exclude_districts = {
@@ -37,9 +37,7 @@ class BritishColumbiaMunicipalitiesPersonScraper(CanadianScraper):
             "100 Mile House": "One Hundred Mile House",
         }
 
-        processed_ids = set()
         exclude_divisions = {}
-        processed_divisions = set()
         infixes = {
             "CY": "City",
             "DM": "District",
@@ -50,30 +48,20 @@ class BritishColumbiaMunicipalitiesPersonScraper(CanadianScraper):
             "VL": "Village",
             "RDA": "District",
         }
-        organizations = {}
-        # Create list mapping names to IDs.
-        names_to_ids = {}
-        for division in Division.get("ocd-division/country:ca").children("csd"):
-            type_id = division.id.rsplit(":", 1)[1]
-            if type_id.startswith("59"):
-                if division.attrs["classification"] == "IRI":
-                    continue
-                if division.name in names_to_ids:
-                    names_to_ids[division.name] = None
-                else:
-                    names_to_ids[division.name] = division.id
+        resolver = division_name_resolver("province:bc", exclude_classifications={"IRI"})
+        self.processed_ids = set()
+        self.processed_divisions = set()
 
         # Scrape list of municpalities.
         list_page = self.lxmlize(LIST_PAGE)
         municipalities = list_page.xpath('//select[@name="lgid"]/option')
         assert len(municipalities), "No municipalities found"
 
-        # Iterate through each municipality.
-        for municipality in municipalities:
+        def scrape_municipality(municipality):
             municipality_text = municipality.text
             municipal_type = municipality_text[municipality_text.find("(") + 1 : municipality_text.find(")")]
             if municipal_type in excluded_district_types:
-                continue
+                return
 
             municipal_id = municipality.get("value")
             division_name = municipality_text.split(" (")[0]
@@ -84,26 +72,24 @@ class BritishColumbiaMunicipalitiesPersonScraper(CanadianScraper):
             # If we have a municipal ID, process that municipality.
             if municipal_id and municipal_id.strip():
                 # Get division ID from municipal name and filter out duplicates or unknowns.
-                if division_name in exclude_districts or division_name in processed_divisions:
-                    continue
-                division_id = names_to_ids[division_name]
-                if not isinstance(division_id, str):
-                    continue
+                if division_name in exclude_districts or division_name in self.processed_divisions:
+                    return
+                division_id = resolver.resolve(division_name)
+                if division_id is None:
+                    return
                 if division_id in exclude_divisions:
-                    continue
-                if division_id in processed_ids:
+                    return
+                if division_id in self.processed_ids:
                     raise Exception("unhandled collision: {}".format(division_id))
-                division = Division.get(division_id)
-                processed_divisions.add(division_name)
+                division = get_division(division_id)
+                self.processed_divisions.add(division_name)
 
                 # Get division name and create org.
                 division_name = division.name
                 organization_name = "{} {} Council".format(division_name, infixes[division.attrs["classification"]])
-                if division_id not in processed_ids:
-                    processed_ids.add(division_id)
-                    organizations[division_id] = Organization(name=organization_name, classification="government")
-                    organizations[division_id].add_source(record_url)
-                organization = organizations[division_id]
+                self.processed_ids.add(division_id)
+                organization = Organization(name=organization_name, classification="government")
+                organization.add_source(record_url)
                 organization.add_post(role="Mayor", label=division_name, division_id=division_id)
                 organization.add_post(role="Councillor", label=division_name, division_id=division_id)
 
@@ -134,10 +120,11 @@ class BritishColumbiaMunicipalitiesPersonScraper(CanadianScraper):
                     yield self.person_data(leader_rep, division_id, division_name, "Mayor", organization_name)
                 for councillor_rep in councillor_reps:
                     yield self.person_data(councillor_rep, division_id, division_name, "Councillor", organization_name)
+                yield organization
 
-        # Iterate through each organization.
-        for organization in organizations.values():
-            yield organization
+        # Checkpoint each municipality, so that a failed crawl resumes where it failed.
+        units = [("{} {}".format(option.get("value"), option.text), option) for option in municipalities]
+        yield from self.scrape_units(units, scrape_municipality)
 
     def person_data(self, representative, division_id, division_name, role, organization_name):
         # Corrections and tweaks.
@@ -1,10 +1,9 @@
 from datetime import date
 
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
 from utils import CanadianPerson as Person
-from utils import CanadianScraper
+from utils import CanadianScraper, division_name_resolver, get_division
 
 COUNCIL_PAGE = "https://docs.google.com/spreadsheets/d/e/2PACX-1vTP3PplANMDX5EkNBwLN1zz4IxDvUcMbT3L2l6RoA5Hr27p5NovyzlpV2wlBNAHsA8sdDxXdMQ78eF0/pub?gid=1928681855&single=true&output=csv"
 
@@ -63,16 +62,7 @@ class BritishColumbiaMunicipalitiesCandidatesPersonScraper(CanadianScraper):
             "Elizabeth Taylor",
         }
 
-        names_to_ids = {}
-        for division in Division.get("ocd-division/country:ca").children("csd"):
-            type_id = division.id.rsplit(":", 1)[1]
-            if type_id.startswith("59"):
-                if division.attrs["classification"] == "IRI":
-                    continue
-                if division.name in names_to_ids:
-                    names_to_ids[division.name] = None
-                else:
-                    names_to_ids[division.name] = division.id
+        resolver = division_name_resolver("province:bc", exclude_classifications={"IRI"})
 
         reader = self.csv_reader(COUNCIL_PAGE, header=True)
         reader.fieldnames = [field.lower() for field in reader.fieldnames]
@@ -94,14 +84,14 @@ class BritishColumbiaMunicipalitiesCandidatesPersonScraper(CanadianScraper):
             if row["district id"]:
                 division_id = "ocd-division/country:ca/csd:{}".format(row["district id"])
             else:
-                division_id = names_to_ids[row["district name"]]
+                division_id = resolver.resolve(row["district name"])
 
             if division_id in exclude_divisions:
                 continue
             if not division_id:
                 raise Exception("unhandled collision: {}".format(row["district name"]))
 
-            division = Division.get(division_id)
+            division = get_division(division_id)
 
             division_name = division.name
 
@@ -1,7 +1,6 @@
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
-from utils import CanadianJurisdiction
+from utils import CanadianJurisdiction, get_division
 
 
 class ManitobaCandidates(CanadianJurisdiction):
@@ -24,7 +23,7 @@ class ManitobaCandidates(CanadianJurisdiction):
     def get_organizations(self):
         organization = Organization(self.name, classification=self.classification)
 
-        for division in Division.get(self.division_id).children("ed"):
+        for division in get_division(self.division_id).children("ed"):
             if division.attrs["validFrom"] == "2019-09-10":
                 organization.add_post(role="candidate", label=division.name)
 
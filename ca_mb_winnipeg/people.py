@@ -1,8 +1,6 @@
 import json
 import re
 
-import requests
-
 from utils import CanadianPerson as Person
 from utils import CanadianScraper
 
@@ -14,7 +12,7 @@ class WinnipegPersonScraper(CanadianScraper):
         # https://winnipeg.ca/council/wards/includes/wards.js
         # var COUNCIL_API = 'https://data.winnipeg.ca/resource/r4tk-7dip.json';
         api_url = "https://data.winnipeg.ca/resource/r4tk-7dip.json"
-        data = json.loads(requests.get(api_url).content)
+        data = json.loads(self.get(api_url).content)
 
         page = self.lxmlize(COUNCIL_PAGE, "utf-8")
 
@@ -92,12 +92,15 @@ class CanadaMunicipalitiesPersonScraper(CSVScraper):
                         p.add_contact("email", row["email"].strip(" .,"))
                     if row["address"]:
                         p.add_contact("address", row["address"], "legislature")
+                    phone, fax, cell = self.telephone_number_normalizer.normalize_many(
+                        [row.get("phone") or "", row.get("fax") or "", row.get("cell") or ""]
+                    )
                     if row.get("phone"):
-                        p.add_contact("voice", row["phone"], "legislature")
+                        p.add_contact("voice", phone, "legislature")
                     if row.get("fax"):
-                        p.add_contact("fax", row["fax"], "legislature")
+                        p.add_contact("fax", fax, "legislature")
                     if row.get("cell"):
-                        p.add_contact("cell", row["cell"], "legislature")
+                        p.add_contact("cell", cell, "legislature")
                     if row.get("birth date"):
                         p.birth_date = row["birth date"]
 
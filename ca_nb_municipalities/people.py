@@ -1,15 +1,15 @@
-import re
-
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
 from utils import CanadianPerson as Person
-from utils import CanadianScraper
+from utils import CanadianScraper, division_name_resolver, get_division
 
 COUNCIL_PAGE = "http://www2.gnb.ca/content/gnb/en/departments/elg/local_government/content/community_profiles.html"
 
 
 class NewBrunswickMunicipalitiesPersonScraper(CanadianScraper):
+    birth_date = 1900
+    checkpoint_attributes = ("birth_date", "seen")
+
     def scrape(self):
         exclude_divisions = {
             "ocd-division/country:ca/csd:1301006",  # Saint John
@@ -32,9 +32,6 @@ class NewBrunswickMunicipalitiesPersonScraper(CanadianScraper):
         }
         corrections = {
             "Beaubassin-est/East": "Beaubassin East",
-            "Lac-Baker": "Lac Baker",
-            "Saint-François-de-Madawaska": "Saint-François de Madawaska",
-            "Saint-Hilaire": "Saint Hilaire",
         }
         unknown_names = {
             "Haut-Madawaska",  # incorporated after Census 2016
@@ -45,110 +42,111 @@ class NewBrunswickMunicipalitiesPersonScraper(CanadianScraper):
             "Luc Levesque",
         }
 
-        names_to_ids = {}
-        for division in Division.get("ocd-division/country:ca").children("csd"):
-            type_id = division.id.rsplit(":", 1)[1]
-            if type_id.startswith("13"):
-                if division.attrs["classification"] == "P":
-                    continue
-                if division.name in names_to_ids:
-                    raise Exception("unhandled collision: {}".format(division.name))
-                else:
-                    names_to_ids[division.name] = division.id
+        resolver = division_name_resolver("province:nb", exclude_classifications={"P"})
 
         page = self.lxmlize(COUNCIL_PAGE)
         list_links = page.xpath('//div[@id="sidebar"]//div[contains(@class, "list")][1]//a')
 
-        birth_date = 1900
-        seen = set()
+        self.seen = set()
 
         assert len(list_links), "No list items found"
+        units = []
         for list_link in list_links:
             page = self.lxmlize(list_link.attrib["href"])
             detail_urls = page.xpath("//td[1]//@href")
 
             assert len(detail_urls), "No municipalities found"
             for detail_url in detail_urls:
-                page = self.lxmlize(detail_url, encoding="utf-8")
-                division_name = re.sub(r"\ASt\b\.?", "Saint", page.xpath("//h1/text()")[0].split(" - ", 1)[1])
-                division_name = corrections.get(division_name, division_name)
-
-                if division_name in unknown_names:
-                    continue
-                division_id = names_to_ids[division_name]
-                if division_id in exclude_divisions:
-                    continue
-                if division_id in seen:
-                    raise Exception("unhandled collision: {}".format(division_id))
-
-                seen.add(division_id)
-                division_name = Division.get(division_id).name
-                organization_name = "{} {} Council".format(division_name, classifications[list_link.text])
-                organization = Organization(name=organization_name, classification="government")
-                organization.add_source(detail_url)
-
-                address = ", ".join(page.xpath('//div[@class="left_contents"]/p[1]/text()'))
-
-                contacts = page.xpath('//div[@class="left_contents"]/p[contains(., "Contact")]/text()')
-                phone = contacts[0].split(":")[1]
-                if len(contacts) > 1:
-                    fax = contacts[1].split(":")[1]
-                email = self.get_email(page, '//div[@class="left_contents"]', error=False)
-
-                url = page.xpath('//div[@class="left_contents"]//@href[not(contains(., "mailto:"))]')
-                if url:
-                    url = url[0]
-
-                groups = page.xpath('//div[contains(@class, "right_contents")]/p')
-                assert len(groups), "No groups found"
-                for p in groups:
-                    role = p.xpath("./b/text()")[0].rstrip("s")
-                    if role not in expected_roles:
-                        raise Exception("unexpected role: {}".format(role))
-
-                    councillors = p.xpath("./text()")
-                    assert len(councillors), "No councillors found"
-                    for seat_number, name in enumerate(councillors, 1):
-                        if "vacant" in name.lower():
-                            continue
-
-                        if role in unique_roles:
-                            district = division_name
-                        else:
-                            district = "{} (seat {})".format(division_name, seat_number)
-
-                        organization.add_post(role=role, label=district, division_id=division_id)
-
-                        p = Person(
-                            primary_org="government",
-                            primary_org_name=organization_name,
-                            name=name,
-                            district=district,
-                            role=role,
-                        )
-                        p.add_source(COUNCIL_PAGE)
-                        p.add_source(list_link.attrib["href"])
-                        p.add_source(detail_url)
-
-                        if name in duplicate_names:
-                            p.birth_date = str(birth_date)
-                            birth_date += 1
-
-                        p.add_contact("address", address, "legislature")
-                        # @see https://en.wikipedia.org/wiki/Area_code_506
-                        if phone:
-                            p.add_contact("voice", phone, "legislature", area_code=506)
-                        if fax:
-                            p.add_contact("fax", fax, "legislature", area_code=506)
-                        if email:
-                            p.add_contact("email", email)
-                        if url:
-                            p.add_link(url)
-
-                        p._related[0].extras["boundary_url"] = "/boundaries/census-subdivisions/{}/".format(
-                            division_id.rsplit(":", 1)[1]
-                        )
-
-                        yield p
-
-                yield organization
+                units.append((detail_url, (list_link, detail_url)))
+
+        def scrape_municipality(unit):
+            list_link, detail_url = unit
+            page = self.lxmlize(detail_url, encoding="utf-8")
+            division_name = page.xpath("//h1/text()")[0].split(" - ", 1)[1]
+            division_name = corrections.get(division_name, division_name)
+
+            if division_name in unknown_names:
+                return
+            division_id = resolver.resolve(division_name)
+            if division_id is None:
+                raise Exception("unhandled collision: {}".format(division_name))
+            if division_id in exclude_divisions:
+                return
+            if division_id in self.seen:
+                raise Exception("unhandled collision: {}".format(division_id))
+
+            self.seen.add(division_id)
+            division_name = get_division(division_id).name
+            organization_name = "{} {} Council".format(division_name, classifications[list_link.text])
+            organization = Organization(name=organization_name, classification="government")
+            organization.add_source(detail_url)
+
+            address = ", ".join(page.xpath('//div[@class="left_contents"]/p[1]/text()'))
+
+            contacts = page.xpath('//div[@class="left_contents"]/p[contains(., "Contact")]/text()')
+            phone = contacts[0].split(":")[1]
+            fax = None
+            if len(contacts) > 1:
+                fax = contacts[1].split(":")[1]
+            email = self.get_email(page, '//div[@class="left_contents"]', error=False)
+
+            url = page.xpath('//div[@class="left_contents"]//@href[not(contains(., "mailto:"))]')
+            if url:
+                url = url[0]
+
+            groups = page.xpath('//div[contains(@class, "right_contents")]/p')
+            assert len(groups), "No groups found"
+            for p in groups:
+                role = p.xpath("./b/text()")[0].rstrip("s")
+                if role not in expected_roles:
+                    raise Exception("unexpected role: {}".format(role))
+
+                councillors = p.xpath("./text()")
+                assert len(councillors), "No councillors found"
+                for seat_number, name in enumerate(councillors, 1):
+                    if "vacant" in name.lower():
+                        continue
+
+                    if role in unique_roles:
+                        district = division_name
+                    else:
+                        district = "{} (seat {})".format(division_name, seat_number)
+
+                    organization.add_post(role=role, label=district, division_id=division_id)
+
+                    p = Person(
+                        primary_org="government",
+                        primary_org_name=organization_name,
+                        name=name,
+                        district=district,
+                        role=role,
+                    )
+                    p.add_source(COUNCIL_PAGE)
+                    p.add_source(list_link.attrib["href"])
+                    p.add_source(detail_url)
+
+                    if name in duplicate_names:
+                        p.birth_date = str(self.birth_date)
+                        self.birth_date += 1
+
+                    p.add_contact("address", address, "legislature")
+                    # @see https://en.wikipedia.org/wiki/Area_code_506
+                    if phone:
+                        p.add_contact("voice", phone, "legislature", area_code=506)
+                    if fax:
+                        p.add_contact("fax", fax, "legislature", area_code=506)
+                    if email:
+                        p.add_contact("email", email)
+                    if url:
+                        p.add_link(url)
+
+                    p._related[0].extras["boundary_url"] = "/boundaries/census-subdivisions/{}/".format(
+                        division_id.rsplit(":", 1)[1]
+                    )
+
+                    yield p
+
+            yield organization
+
+        # Checkpoint each municipality, so that a failed crawl resumes where it failed.
+        yield from self.scrape_units(units, scrape_municipality)
@@ -17,12 +17,16 @@ class OntarioPersonScraper(CanadianScraper):
         members = page.xpath('//div[@class="view-content"]//h2')
         # print(members)
         assert len(members), "No members found"
+        names = []
+        urls = []
         for member in members:
             name = member.xpath(".//a//text()")[0]
             if "Vacant seat" in name:
                 continue
-            url = member.xpath(".//a//@href")[0]
-            node = self.lxmlize(url, encoding="utf-8")
+            names.append(name)
+            urls.append(member.xpath(".//a//@href")[0])
+
+        for name, (url, node) in zip(names, self.lxmlize_many(urls, encoding="utf-8")):
             fax = node.xpath(
                 '//div[@class="field field--name-field-fax-number field--type-string field--label-inline"]//div[@class="field__item"]//text()'
             )
@@ -1,5 +1,5 @@
 from utils import CanadianPerson as Person
-from utils import CanadianScraper
+from utils import CanadianScraper, memoize_extraction
 
 COUNCIL_PAGE = "http://www.markham.ca/wps/portal/Markham/MunicipalGovernment/MayorAndCouncil/RegionalAndWardCouncillors/!ut/p/a1/04_Sj9CPykssy0xPLMnMz0vMAfGjzOJN_N2dnX3CLAKNgkwMDDw9XcJM_VwCDUMDDfULsh0VAfz7Fis!/"
 
@@ -55,6 +55,7 @@ class MarkhamPersonScraper(CanadianScraper):
 
             yield p
 
+    @memoize_extraction
     def get_contact(self, url):
         page = self.lxmlize(url)
 
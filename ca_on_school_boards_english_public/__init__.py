@@ -1,7 +1,6 @@
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
-from utils import CanadianJurisdiction
+from utils import CanadianJurisdiction, get_division
 
 
 class OntarioEnglishPublicSchoolBoards(CanadianJurisdiction):
@@ -15,7 +14,7 @@ class OntarioEnglishPublicSchoolBoards(CanadianJurisdiction):
         organization = Organization(self.name, classification="committee")
         organization.add_source(self.url)
 
-        for division in Division.get(self.division_id).children("school_district"):
+        for division in get_division(self.division_id).children("school_district"):
             organization.add_post(role="Chair", label=division.name, division_id=division.id)
             for i in range(0, 22):  # XXX made-up number
                 organization.add_post(
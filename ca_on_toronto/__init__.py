@@ -1,7 +1,6 @@
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
-from utils import CanadianJurisdiction
+from utils import CanadianJurisdiction, get_division
 
 
 class Toronto(CanadianJurisdiction):
@@ -15,7 +14,7 @@ class Toronto(CanadianJurisdiction):
         organization = Organization(self.name, classification=self.classification)
 
         organization.add_post(role="Mayor", label=self.division_name, division_id=self.division_id)
-        for division in Division.get(self.division_id).children("ward"):
+        for division in get_division(self.division_id).children("ward"):
             if "2018" in division.id:
                 organization.add_post(role="Councillor", label=division.name, division_id=division.id)
 
@@ -194,7 +194,12 @@ class QuebecPersonScraper(CanadianScraper):
         members = page.xpath('//*[@id="ListeDeputes"]/tbody/tr')
 
         assert len(members), "No members found"
-        for row in members:
+        detail_urls = [row[0][0].attrib["href"] for row in members]
+        contact_urls = [detail_url.replace("index.html", "coordonnees.html") for detail_url in detail_urls]
+        detail_pages = self.lxmlize_many(detail_urls)
+        contact_pages = self.lxmlize_many(contact_urls)
+
+        for row, (detail_url, detail_page), (_, contact_page) in zip(members, detail_pages, contact_pages):
             name_comma, division = [cell.text_content() for cell in row[:2]]
 
             name = " ".join(reversed(name_comma.strip().split(",")))
@@ -207,12 +212,6 @@ class QuebecPersonScraper(CanadianScraper):
 
             email = self.get_email(row[3], error=False)
 
-            detail_url = row[0][0].attrib["href"]
-            detail_page = self.lxmlize(detail_url)
-
-            contact_url = detail_url.replace("index.html", "coordonnees.html")
-            contact_page = self.lxmlize(contact_url)
-
             photo_url = detail_page.xpath('//img[@class="photoDepute"]/@src')
 
             p = Person(primary_org="legislature", name=name, district=division, role="MNA", party=party)
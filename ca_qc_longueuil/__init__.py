@@ -1,8 +1,7 @@
 # coding: utf-8
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
-from utils import CanadianJurisdiction
+from utils import CanadianJurisdiction, get_division
 
 
 class Longueuil(CanadianJurisdiction):
@@ -17,7 +16,7 @@ class Longueuil(CanadianJurisdiction):
         organization = Organization(self.name, classification=self.classification)
 
         organization.add_post(role="Maire", label=self.division_name, division_id=self.division_id)
-        for division in Division.get(self.division_id).children("district"):
+        for division in get_division(self.division_id).children("district"):
             if division.name == "Greenfield Park":
                 for seat_number in range(1, 4):
                     organization.add_post(
@@ -1,7 +1,6 @@
-from opencivicdata.divisions import Division
 from pupa.scrape import Organization
 
-from utils import CanadianJurisdiction
+from utils import CanadianJurisdiction, get_division
 
 
 class Montreal(CanadianJurisdiction):
@@ -29,13 +28,13 @@ class Montreal(CanadianJurisdiction):
             role="Maire de la Ville de Montréal", label=self.division_name, division_id=self.division_id
         )  # 0,00
 
-        for division in Division.get(self.division_id).children("borough"):  # 18
+        for division in get_division(self.division_id).children("borough"):  # 18
             if (
                 division.id != "ocd-division/country:ca/csd:2466023/borough:18"
             ):  # Maire de la Ville de Montréal is Maire d'arrondissement for Ville-Marie
                 organization.add_post(role="Maire d'arrondissement", label=division.name, division_id=division.id)
 
-        for division in Division.get(self.division_id).children("district"):  # 46
+        for division in get_division(self.division_id).children("district"):  # 46
             borough_id = division.id.rsplit(":", 1)[1].split(".", 1)[0]
             if borough_id not in ("2", "4", "6", "9"):
                 organization.add_post(role="Conseiller de la ville", label=division.name, division_id=division.id)
@@ -0,0 +1,197 @@
+# coding: utf-8
+"""
+Compiles `country-ca.csv` into a SQLite index, so that divisions can be looked
+up without parsing the CSV in every process.
+
+The index is rebuilt automatically if the CSV changes, or with:
+
+    invoke divisions_index
+"""
+
+import csv
+import json
+import os
+import sqlite3
+import threading
+
+# The format version of the index. Increment it if the schema changes.
+VERSION = 1
+# The types of division whose type IDs are Standard Geographical Classification codes.
+SGC_TYPES = ("cd", "csd")
+
+ocd_division_csv = os.environ.get(
+    "OCD_DIVISION_CSV", os.path.join(os.path.abspath(os.path.dirname(__file__)), "country-{}.csv")
+).format("ca")
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE divisions (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    type TEXT,
+    type_id TEXT,
+    name TEXT,
+    sgc TEXT,
+    attrs TEXT
+);
+CREATE INDEX divisions_parent_id_type ON divisions (parent_id, type);
+CREATE INDEX divisions_type_sgc ON divisions (type, sgc);
+CREATE INDEX divisions_sgc ON divisions (sgc);
+CREATE INDEX divisions_name ON divisions (name);
+"""
+
+
+class IndexedDivision(object):
+    """
+    A division read from the index. It has the same interface as
+    `opencivicdata.divisions.Division`.
+    """
+
+    def __init__(self, index, id, parent_id, type, name, attrs):
+        self.index = index
+        self.id = id
+        self.parent_id = parent_id
+        self._type = type
+        self.name = name
+        self.attrs = json.loads(attrs)
+
+    def __repr__(self):
+        return "<IndexedDivision {}>".format(self.id)
+
+    @property
+    def parent(self):
+        if self.parent_id:
+            try:
+                return self.index.get(self.parent_id)
+            except KeyError:
+                pass
+
+    def children(self, _type=None, **kwargs):
+        for division in self.index.children(self.id, _type):
+            if all(division.attrs.get(k) == v for k, v in kwargs.items()):
+                yield division
+
+
+class DivisionIndex(object):
+    def __init__(self, csv_path, path):
+        self.csv_path = csv_path
+        self.path = path
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def source_signature(self):
+        """
+        Returns a value that changes if the CSV changes.
+        """
+        stat = os.stat(self.csv_path)
+        return "{}:{}:{}".format(VERSION, stat.st_size, stat.st_mtime_ns)
+
+    def is_stale(self):
+        try:
+            connection = sqlite3.connect("file:{}?mode=ro".format(self.path), uri=True)
+            try:
+                row = connection.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+            finally:
+                connection.close()
+        except sqlite3.Error:
+            return True
+        return not row or row[0] != self.source_signature()
+
+    def build(self):
+        """
+        Compiles the CSV into the index.
+        """
+        signature = self.source_signature()
+        tmp = "{}.{}".format(self.path, os.getpid())
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+        connection = sqlite3.connect(tmp)
+        try:
+            connection.executescript(SCHEMA)
+            with open(self.csv_path, encoding="utf-8") as f:
+                rows = []
+                for row in csv.DictReader(f):
+                    id = row.pop("id")
+                    name = row.pop("name")
+                    parent_id, own = id.rsplit("/", 1)
+                    if parent_id == "ocd-division":
+                        parent_id = None
+                    type, type_id = own.split(":", 1)
+                    sgc = row.get("sgc") or (type_id if type in SGC_TYPES else None)
+                    rows.append((id, parent_id, type, type_id, name, sgc, json.dumps(row)))
+            connection.executemany("INSERT INTO divisions VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            connection.execute("INSERT INTO meta VALUES ('signature', ?)", (signature,))
+            connection.commit()
+        finally:
+            connection.close()
+        os.replace(tmp, self.path)
+
+    @property
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            with self.lock:
+                if self.is_stale():
+                    self.build()
+            connection = sqlite3.connect("file:{}?mode=ro".format(self.path), uri=True)
+            # Memory-map the index, so that processes share its pages.
+            connection.execute("PRAGMA mmap_size = 67108864")
+            self.local.connection = connection
+        return connection
+
+    def _query(self, where, parameters=()):
+        sql = "SELECT id, parent_id, type, name, attrs FROM divisions WHERE {} ORDER BY rowid".format(where)
+        for row in self.connection.execute(sql, parameters):
+            yield IndexedDivision(self, *row)
+
+    def get(self, division_id):
+        """
+        Returns the division with the given identifier, or raises `KeyError`.
+        """
+        for division in self._query("id = ?", (division_id,)):
+            return division
+        raise KeyError(division_id)
+
+    def all(self, *types):
+        """
+        Returns all divisions, optionally of the given types, in CSV order.
+        """
+        if types:
+            return self._query("type IN ({})".format(", ".join("?" * len(types))), types)
+        return self._query("1")
+
+    def children(self, parent_id, _type=None):
+        """
+        Returns the children of the division, optionally of the given type.
+        """
+        if _type:
+            return self._query("parent_id = ? AND type = ?", (parent_id, _type))
+        return self._query("parent_id = ?", (parent_id,))
+
+    def by_sgc_prefix(self, prefix, _type=None):
+        """
+        Returns the divisions whose Standard Geographical Classification code
+        starts with the prefix, e.g. "59" for all census subdivisions in BC.
+        """
+        # The range is equivalent to a prefix match and can use the index.
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        if _type:
+            return self._query("type = ? AND sgc >= ? AND sgc < ?", (_type, prefix, upper))
+        return self._query("sgc >= ? AND sgc < ?", (prefix, upper))
+
+    def ids_by_name(self, _type, sgc_prefix=None):
+        """
+        Returns a dictionary of division names to lists of division identifiers.
+        """
+        if sgc_prefix:
+            divisions = self.by_sgc_prefix(sgc_prefix, _type)
+        else:
+            divisions = self.all(_type)
+        names = {}
+        for division in divisions:
+            names.setdefault(division.name, []).append(division.id)
+        return names
+
+
+division_index = DivisionIndex(ocd_division_csv, os.path.splitext(ocd_division_csv)[0] + ".sqlite3")
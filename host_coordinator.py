@@ -0,0 +1,194 @@
+# coding: utf-8
+"""
+Coordinates requests to the same host across scraper processes on one machine,
+with file locks in a shared directory. No server is needed.
+
+* At most `concurrency` requests to a host are in flight at once, across all
+  processes: each request holds one of the host's `concurrency` lock files.
+* Requests to a host are spaced out by `interval` seconds, and a Retry-After
+  delay received by one process pauses requests to the host in all processes.
+* Identical GET requests made at the same time by different processes are
+  merged: one process downloads the response, and the others read it.
+
+Coordination is enabled by setting `HOST_COORDINATOR_DIR` to a directory, which
+`invoke update` does for its workers.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+# How often to check for a free slot, in seconds.
+POLL_INTERVAL = 0.05
+
+
+class HostCoordinator(object):
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def _filename(self, *parts):
+        directory = os.path.join(self.path, parts[0])
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, *parts[1:])
+
+    @contextlib.contextmanager
+    def slot(self, host, concurrency, interval=0):
+        """
+        Waits until fewer than `concurrency` requests to the host are in flight
+        in all processes, and until the host's next request is allowed.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        while True:
+            for i in range(concurrency):
+                fd = os.open(self._filename("hosts", "{}.{}.lock".format(host, i)), os.O_CREAT | os.O_RDWR)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                try:
+                    self._wait_turn(host, interval)
+                    yield
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+                    os.close(fd)
+                return
+            time.sleep(POLL_INTERVAL)
+
+    def _wait_turn(self, host, interval):
+        with self._schedule(host) as schedule:
+            delay = schedule.get("not_before", 0) - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            if interval:
+                schedule["not_before"] = time.time() + interval
+
+    def pause(self, host, seconds):
+        """
+        Pauses requests to the host in all processes, e.g. after a Retry-After header.
+        """
+        if not self.enabled:
+            return
+        with self._schedule(host) as schedule:
+            schedule["not_before"] = max(schedule.get("not_before", 0), time.time() + seconds)
+
+    @contextlib.contextmanager
+    def _schedule(self, host):
+        # The schedule is read and written under an exclusive lock, which also
+        # serializes the waits for the host's next allowed request.
+        with open(self._filename("hosts", "{}.schedule".format(host)), "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                try:
+                    schedule = json.loads(f.read() or "{}")
+                except ValueError:
+                    schedule = {}
+                original = dict(schedule)
+                yield schedule
+                if schedule != original:
+                    f.seek(0)
+                    f.truncate()
+                    f.write(json.dumps(schedule))
+                    f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def coalesce(self, key, fetch, build):
+        """
+        Returns `fetch()` and `False`, unless another process is already
+        fetching the same `key`, in which case it waits for that process's
+        response, and returns it, rebuilt with `build(url, status_code, headers,
+        body)`, and `True`.
+
+        Only 200 responses are shared. If the other process gets any other
+        response, or fails, this process fetches the key itself.
+        """
+        if not self.enabled:
+            return fetch(), False
+
+        digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        filename = self._filename("responses", digest)
+        waiting_since = time.time()
+        fd = os.open(filename + ".lock", os.O_CREAT | os.O_RDWR)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is fetching the key. Wait for it to finish.
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                response = self._read(filename, waiting_since, build)
+                if response is not None:
+                    return response, True
+                fcntl.flock(fd, fcntl.LOCK_EX)
+
+            response = fetch()
+            if response.status_code == 200:
+                self._write(filename, response)
+            return response, False
+        finally:
+            os.close(fd)
+
+    def _read(self, filename, since, build):
+        try:
+            with open(filename + ".json") as f:
+                metadata = json.load(f)
+            with open(filename + ".body", "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        # Ignore a response that was downloaded before this process started waiting.
+        if metadata["time"] < since or len(body) != metadata["size"]:
+            return None
+        return build(metadata["url"], metadata["status_code"], metadata["headers"], body)
+
+    def _write(self, filename, response):
+        metadata = {
+            "url": response.url,
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+            "size": len(response.content),
+            "time": time.time(),
+        }
+        # Write to temporary files and rename, so that readers never see a partial entry.
+        suffix = "{}.{}".format(os.getpid(), threading.get_ident())
+        for extension, mode, content in ((".body", "wb", response.content), (".json", "w", metadata)):
+            tmp = "{}{}.{}".format(filename, extension, suffix)
+            with open(tmp, mode) as f:
+                if extension == ".json":
+                    json.dump(content, f)
+                else:
+                    f.write(content)
+            os.replace(tmp, filename + extension)
+
+    def prune(self, max_age=3600):
+        """
+        Deletes shared responses older than `max_age` seconds.
+        """
+        if not self.enabled:
+            return
+        directory = self._filename("responses")
+        cutoff = time.time() - max_age
+        for name in os.listdir(directory):
+            if not name.endswith(".lock"):
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except OSError:
+                    pass
+
+
+host_coordinator = HostCoordinator(os.environ.get("HOST_COORDINATOR_DIR"))
@@ -1,8 +1,12 @@
 # coding: utf-8
 
+import logging
+import os
 from copy import deepcopy
 
 import regex as re
+from pupa import settings
+from pupa.cli.commands import update
 from pupa.scrape.schemas.common import contact_details as _contact_details
 from pupa.scrape.schemas.common import links as _links
 from pupa.scrape.schemas.common import sources as _sources
@@ -173,3 +177,30 @@ def validate_maxMatchingItems(self, x, fieldname, schema, path, arguments=None):
 
 
 DatetimeValidator.validate_maxMatchingItems = validate_maxMatchingItems
+
+
+_do_scrape = update.Command.do_scrape
+_do_import = update.Command.do_import
+
+
+def do_scrape(self, juris, args, scrapers):
+    self.scrape_report = _do_scrape(self, juris, args, scrapers)
+    return self.scrape_report
+
+
+# Skip the import if every scraper reused the output of a run that was imported.
+def do_import(self, juris, args):
+    from utils import ScrapeSnapshot
+
+    records = [record for name, record in getattr(self, "scrape_report", {}).items() if name != "jurisdiction"]
+    if records and all(record.get("unchanged") and record.get("imported") for record in records):
+        logging.getLogger("pupa").info("import skipped, as no source changed since the last import")
+        return {}
+
+    report = _do_import(self, juris, args)
+    ScrapeSnapshot.mark_imported(os.path.join(settings.SCRAPED_DATA_DIR, args.module))
+    return report
+
+
+update.Command.do_scrape = do_scrape
+update.Command.do_import = do_import
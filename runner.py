@@ -0,0 +1,400 @@
+# coding: utf-8
+"""
+Runs `pupa update` for many jurisdictions in a pool of worker processes.
+
+Each worker imports pupa, Django and `utils` once, and then runs one
+jurisdiction after another, writing each jurisdiction's output to its own
+log file. A jurisdiction that exceeds its timeout is stopped by terminating
+its worker, which is then replaced.
+
+The workers coordinate their requests to each host, and share the responses to
+identical requests, through `host_coordinator`.
+"""
+
+import argparse
+import contextlib
+import glob
+import hashlib
+import json
+import logging.config
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+import traceback
+from collections import Counter, deque
+from multiprocessing.connection import wait
+from urllib.parse import urlparse
+
+from pupa import settings
+
+from host_coordinator import host_coordinator
+
+
+def enable_host_coordinator():
+    """
+    Coordinates requests from this process and the processes it starts.
+    """
+    if not host_coordinator.enabled:
+        host_coordinator.path = os.environ["HOST_COORDINATOR_DIR"] = os.path.join(settings.CACHE_DIR, "coordinator")
+    host_coordinator.prune()
+
+
+def run_module(module_name, actions=(), datadir=None):
+    """
+    Runs `pupa update` for the module in this process, and returns a summary.
+    """
+    from pupa.cli.commands import update
+
+    result = {
+        "module": module_name,
+        "status": "ok",
+        "error": "",
+        "exception": None,
+        "url": None,
+        "objects": {},
+        "bytes_fetched": 0,
+        "unchanged": False,
+        "sources_digest": None,
+        "start": time.time(),
+    }
+
+    parser = argparse.ArgumentParser("pupa")
+    command = update.Command(parser.add_subparsers(dest="subcommand"))
+    argv = ["update", module_name] + ["--{}".format(action) for action in actions]
+    if datadir:
+        argv += ["--datadir", datadir]
+
+    try:
+        args, other = parser.parse_known_args(argv)
+        report = command.handle(args, other)
+        objects = Counter()
+        records = [record for name, record in report.get("scrape", {}).items() if name != "jurisdiction"]
+        for record in records:
+            objects.update(record["objects"])
+            result["bytes_fetched"] += record.get("bytes_fetched", 0)
+        result["objects"] = dict(objects)
+        result["unchanged"] = bool(records) and all(record.get("unchanged") for record in records)
+        if records and all(record.get("sources_digest") for record in records):
+            digests = sorted(record["sources_digest"] for record in records)
+            result["sources_digest"] = hashlib.sha1(" ".join(digests).encode("utf-8")).hexdigest()
+    except Exception as e:
+        traceback.print_exc()
+        result["status"] = "failed"
+        result["error"] = "{}: {}".format(type(e).__name__, e)
+        result["exception"] = type(e).__name__
+        result["url"] = getattr(e, "url", None)
+
+    result["seconds"] = time.time() - result["start"]
+    return result
+
+
+@contextlib.contextmanager
+def redirect_output(path):
+    """
+    Redirects the process's standard output and error, including log handlers
+    that hold a reference to `sys.stderr`, to the file.
+    """
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved = (os.dup(1), os.dup(2))
+    with open(path, "w") as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+        try:
+            yield
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os.dup2(saved[0], 1)
+            os.dup2(saved[1], 2)
+            os.close(saved[0])
+            os.close(saved[1])
+
+
+def worker_main(connection, actions, datadir, logdir):
+    """
+    Runs the modules received on the connection, until it receives `None`.
+    """
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "pupa.settings")
+    from django.conf import settings as django_settings
+
+    logging.config.dictConfig(django_settings.LOGGING)
+
+    while True:
+        module_name = connection.recv()
+        if module_name is None:
+            break
+        with redirect_output(os.path.join(logdir, "{}.log".format(module_name))):
+            result = run_module(module_name, actions, datadir)
+        connection.send(result)
+
+
+class Worker(object):
+    def __init__(self, context, actions, datadir, logdir):
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=worker_main, args=(child_connection, actions, datadir, logdir), daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+        self.module_name = None
+        self.deadline = None
+
+    def send(self, module_name, timeout):
+        self.module_name = module_name
+        self.deadline = time.time() + timeout
+        self.connection.send(module_name)
+
+    def kill(self):
+        self.process.terminate()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.kill()
+
+
+class Runner(object):
+    """
+    Runs jurisdictions in a pool of `processes` worker processes.
+
+    `timeout` is the number of seconds after which to stop a jurisdiction.
+    `actions` are the `pupa update` actions to run ("scrape", "import"), all
+    by default. Each jurisdiction's output is written to `datadir`/<module>,
+    and its log to `logdir`/<module>.log.
+    """
+
+    def __init__(self, processes=None, timeout=1800, actions=(), datadir=None, logdir=None):
+        self.processes = processes or os.cpu_count()
+        self.timeout = timeout
+        self.actions = actions
+        self.datadir = datadir or settings.SCRAPED_DATA_DIR
+        self.logdir = logdir or os.path.join(self.datadir, "_logs")
+        self.context = multiprocessing.get_context("fork")
+        # The maximum number of seconds between calls to `_tick`, if any.
+        self.poll_interval = None
+
+    def _worker(self):
+        return Worker(self.context, self.actions, self.datadir, self.logdir)
+
+    def run(self, module_names):
+        """
+        Runs the modules, in order, and yields their summaries as they finish.
+        """
+        self.pending = deque(module_names)
+        return self._run()
+
+    def _next_module(self):
+        """
+        Returns the next module to run, or `None` if there is none for now.
+        """
+        if self.pending:
+            return self.pending.popleft()
+
+    def _finished(self):
+        """
+        Returns whether no modules remain to be run, once the busy workers finish.
+        """
+        return not self.pending
+
+    def _tick(self, workers):
+        """
+        Called at least every `poll_interval` seconds with the busy workers.
+        """
+
+    def _run(self):
+        os.makedirs(self.logdir, exist_ok=True)
+        enable_host_coordinator()
+        idle = []
+        busy = []
+
+        try:
+            while True:
+                while len(busy) < self.processes:
+                    module_name = self._next_module()
+                    if module_name is None:
+                        break
+                    worker = idle.pop() if idle else self._worker()
+                    worker.send(module_name, self.timeout)
+                    busy.append(worker)
+                if not busy and self._finished():
+                    break
+
+                seconds = self.poll_interval
+                if busy:
+                    seconds = max(0, min(worker.deadline for worker in busy) - time.time())
+                    if self.poll_interval is not None:
+                        seconds = min(seconds, self.poll_interval)
+                    ready = wait([worker.connection for worker in busy], seconds)
+                else:
+                    # Wait for modules to become available.
+                    time.sleep(seconds)
+                    ready = []
+                self._tick(busy)
+
+                for worker in list(busy):
+                    if worker.connection in ready:
+                        busy.remove(worker)
+                        try:
+                            yield worker.connection.recv()
+                            idle.append(worker)
+                        except EOFError:
+                            # The worker died, e.g. by a segmentation fault.
+                            worker.process.join(5)
+                            yield self._failure(worker, "crashed", "Exit code {}".format(worker.process.exitcode))
+                    elif time.time() >= worker.deadline:
+                        busy.remove(worker)
+                        worker.kill()
+                        yield self._failure(worker, "timeout", "Stopped after {}s".format(self.timeout))
+        finally:
+            for worker in idle + busy:
+                worker.stop()
+
+    def _failure(self, worker, status, error):
+        return {
+            "module": worker.module_name,
+            "status": status,
+            "error": error,
+            "exception": None,
+            "url": None,
+            "objects": {},
+            "bytes_fetched": 0,
+            "unchanged": False,
+            "sources_digest": None,
+            "start": worker.deadline - self.timeout,
+            "seconds": time.time() - (worker.deadline - self.timeout),
+        }
+
+
+def format_bytes(number):
+    for unit in ("B", "KB", "MB"):
+        if number < 1024:
+            return "{:.0f} {}".format(number, unit)
+        number /= 1024
+    return "{:.1f} GB".format(number)
+
+
+def print_summary(results, seconds):
+    """
+    Prints a table of the jurisdictions' status, wall time, bytes fetched and
+    object counts, and the totals.
+    """
+    for result in sorted(results, key=lambda result: result["module"]):
+        objects = ", ".join("{} {}".format(count, _type) for _type, count in sorted(result["objects"].items()))
+        if result["unchanged"]:
+            objects += " (unchanged)"
+        print(
+            "{:<45} {:<8} {:>7.1f}s {:>9}  {}".format(
+                result["module"],
+                result["status"],
+                result["seconds"],
+                format_bytes(result["bytes_fetched"]),
+                result["error"] or objects,
+            )
+        )
+
+    statuses = Counter(result["status"] for result in results)
+    print(
+        "{} jurisdictions in {:.0f}s: {}; {} fetched".format(
+            len(results),
+            seconds,
+            ", ".join("{} {}".format(count, status) for status, count in sorted(statuses.items())),
+            format_bytes(sum(result["bytes_fetched"] for result in results)),
+        )
+    )
+
+
+def write_report(path, results, seconds):
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump({"seconds": seconds, "results": results}, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def write_failures(path, results, start):
+    """
+    Writes a ledger of the jurisdictions that didn't finish successfully, for
+    `invoke rerun_failed`. `start` is the time at which the batch started.
+    """
+    failures = [
+        {
+            "module": result["module"],
+            "status": result["status"],
+            "exception": result["exception"],
+            "error": result["error"],
+            "url": result["url"],
+            "host": urlparse(result["url"]).netloc if result["url"] else None,
+            "seconds": result["seconds"],
+        }
+        for result in sorted(results, key=lambda result: result["module"])
+        if result["status"] != "ok"
+    ]
+    tmp = "{}.{}".format(path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump({"start": start, "failures": failures}, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def read_report(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def merge_outputs(sources, destination):
+    """
+    Merges the outputs of jurisdictions run on other nodes, each in a copy of
+    its node's `SCRAPED_DATA_DIR`, into the destination, so that they can be
+    imported together. Returns the merged modules.
+
+    Only the jurisdictions that ran successfully according to each node's
+    `_logs/report.json` are merged, as a data directory can hold the outputs of
+    earlier runs. The outputs of a jurisdiction must come from only one node.
+    The reports are merged into `destination`/_logs/report.json.
+    """
+    destination = os.path.realpath(destination)
+    origins = {}
+    results = []
+    seconds = 0
+    for source in sources:
+        source = os.path.realpath(source)
+        logdir = os.path.join(source, "_logs")
+        if not os.path.exists(os.path.join(logdir, "report.json")):
+            raise Exception("{} has no report of its run".format(source))
+        report = read_report(os.path.join(logdir, "report.json"))
+        results.extend(report["results"])
+        seconds = max(seconds, report["seconds"])
+
+        for module_name in sorted({result["module"] for result in report["results"] if result["status"] == "ok"}):
+            filenames = sorted(glob.glob(os.path.join(source, module_name, "*.json")))
+            if not filenames:
+                continue
+            if module_name in origins:
+                raise Exception("{} has output in both {} and {}".format(module_name, origins[module_name], source))
+            origins[module_name] = source
+
+            if source != destination:
+                directory = os.path.join(destination, module_name)
+                os.makedirs(directory, exist_ok=True)
+                # Remove any output of an earlier run, which pupa would otherwise import.
+                for filename in glob.glob(os.path.join(directory, "*.json")):
+                    os.unlink(filename)
+                for filename in filenames:
+                    shutil.copy2(filename, directory)
+
+        if source != destination:
+            os.makedirs(os.path.join(destination, "_logs"), exist_ok=True)
+            for filename in glob.glob(os.path.join(logdir, "*.log")):
+                shutil.copy2(filename, os.path.join(destination, "_logs"))
+
+    write_report(os.path.join(destination, "_logs", "report.json"), results, seconds)
+    return sorted(origins)
@@ -0,0 +1,224 @@
+# coding: utf-8
+"""
+Records the history of jurisdictions' runs in a SQLite database, and plans
+batches from it:
+
+* Jurisdictions are run longest first, so that long crawls like
+  `ca_bc_municipalities` don't start last and finish after everything else.
+* A jurisdiction whose sources were unchanged for several consecutive runs is
+  run less often, up to once every `max_interval` seconds. When it does run,
+  it is usually cheap: a scraper whose sources are unchanged re-requests them
+  conditionally and reuses its last output (see `ScrapeSnapshot` in `utils.py`).
+  In between, `invoke update --schedule` probes its entry page, and runs it if
+  the page changed (see `probe_entry_sources` in `tasks.py`).
+
+Jurisdictions can also be split into shards of similar total run time, to run
+on different nodes, whose outputs are then merged (see `runner.merge_outputs`).
+"""
+
+import os
+import sqlite3
+import statistics
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    module TEXT,
+    start REAL,
+    seconds REAL,
+    bytes_fetched INTEGER,
+    status TEXT,
+    sources_digest TEXT,
+    changed INTEGER
+);
+CREATE INDEX IF NOT EXISTS runs_module_start ON runs (module, start);
+"""
+
+
+class History(object):
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def runs(self, module_name, limit=None):
+        """
+        Returns the module's runs as dictionaries, most recent first.
+        """
+        sql = "SELECT * FROM runs WHERE module = ? ORDER BY start DESC"
+        if limit:
+            sql += " LIMIT {:d}".format(limit)
+        cursor = self.connection.execute(sql, (module_name,))
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def record(self, result):
+        """
+        Records a result returned by `Runner.run`, and returns whether the
+        jurisdiction's sources changed since its last successful run.
+        """
+        changed = None
+        if result["status"] == "ok":
+            previous = self.connection.execute(
+                "SELECT sources_digest FROM runs WHERE module = ? AND status = 'ok' ORDER BY start DESC LIMIT 1",
+                (result["module"],),
+            ).fetchone()
+            changed = not (
+                result["unchanged"]
+                or (result["sources_digest"] and previous and previous[0] == result["sources_digest"])
+            )
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    result["module"],
+                    result["start"],
+                    result["seconds"],
+                    result["bytes_fetched"],
+                    result["status"],
+                    result["sources_digest"],
+                    changed,
+                ),
+            )
+        return changed
+
+    def estimated_seconds(self, module_name, runs=5):
+        """
+        Returns the median run time of the module's last successful runs, or
+        `None` if it has none.
+        """
+        seconds = [run["seconds"] for run in self.runs(module_name, runs * 2) if run["status"] == "ok"][:runs]
+        if seconds:
+            return statistics.median(seconds)
+
+    def costs(self):
+        """
+        Returns the estimated run time of each module that has run successfully.
+        """
+        costs = {}
+        for (module_name,) in self.connection.execute("SELECT DISTINCT module FROM runs ORDER BY module"):
+            seconds = self.estimated_seconds(module_name)
+            if seconds is not None:
+                costs[module_name] = seconds
+        return costs
+
+    def merge(self, path):
+        """
+        Adds the runs in another history, e.g. another node's, that aren't in this history.
+        """
+        self.connection.execute("ATTACH DATABASE ? AS other", (path,))
+        try:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO runs SELECT * FROM other.runs AS o WHERE NOT EXISTS "
+                    "(SELECT 1 FROM runs WHERE module = o.module AND start = o.start)"
+                )
+        finally:
+            self.connection.execute("DETACH DATABASE other")
+
+    def unchanged_streak(self, module_name):
+        """
+        Returns the number of the module's consecutive most recent successful
+        runs whose sources were unchanged. Failed runs are ignored.
+        """
+        streak = 0
+        for run in self.runs(module_name):
+            if run["status"] != "ok":
+                continue
+            if run["changed"]:
+                break
+            streak += 1
+        return streak
+
+
+class Scheduler(object):
+    """
+    Plans batches from the history.
+
+    A jurisdiction whose sources were unchanged in its last `grace` successful
+    runs is skipped until `interval` seconds after its last run, doubling with
+    each further unchanged run, up to `max_interval`. A jurisdiction whose last
+    run failed is never skipped.
+    """
+
+    def __init__(self, history, interval=20 * 3600, max_interval=7 * 24 * 3600, grace=3):
+        self.history = history
+        self.interval = interval
+        self.max_interval = max_interval
+        self.grace = grace
+
+    def interval_of(self, module_name):
+        """
+        Returns the minimum number of seconds between runs of the module.
+        """
+        streak = self.history.unchanged_streak(module_name)
+        if streak < self.grace:
+            return 0
+        return min(self.max_interval, self.interval * 2 ** (streak - self.grace))
+
+    def is_due(self, module_name, now=None):
+        runs = self.history.runs(module_name, 1)
+        if not runs or runs[0]["status"] != "ok":
+            return True
+        return (now or time.time()) - runs[0]["start"] >= self.interval_of(module_name)
+
+    def plan(self, module_names, now=None):
+        """
+        Returns the modules to run, longest first, and the modules to skip.
+        """
+        due = []
+        skipped = []
+        for module_name in module_names:
+            if self.is_due(module_name, now):
+                due.append(module_name)
+            else:
+                skipped.append(module_name)
+
+        return self.order(due), skipped
+
+    def order(self, module_names):
+        """
+        Returns the modules, longest first. Modules that have never run
+        successfully are first, as their run time is unknown.
+        """
+        estimates = {module_name: self.history.estimated_seconds(module_name) for module_name in module_names}
+        return sorted(
+            module_names,
+            key=lambda module_name: (estimates[module_name] is not None, -(estimates[module_name] or 0)),
+        )
+
+
+def parse_shard(value):
+    """
+    Parses a shard like "2/4" (the second of four shards) into `(2, 4)`.
+    """
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise Exception("Shard must be like 2/4, not {}".format(value))
+    if not 1 <= index <= count:
+        raise Exception("Shard {} must be between 1 and {}".format(index, count))
+    return index, count
+
+
+def shard_modules(module_names, index, count, costs):
+    """
+    Returns the modules in shard `index` of `count`, balancing the shards'
+    total cost in seconds. Modules without a cost are assumed to cost the median.
+
+    Every node must use the same module names and costs to get complementary
+    shards: the assignment depends on nothing else.
+    """
+    known = [costs[module_name] for module_name in module_names if module_name in costs]
+    default = statistics.median(known) if known else 1
+
+    # Assign the costliest remaining module to the least loaded shard.
+    loads = [0] * count
+    shards = [[] for _ in range(count)]
+    ordered = sorted(set(module_names), key=lambda module_name: (-costs.get(module_name, default), module_name))
+    for module_name in ordered:
+        i = loads.index(min(loads))
+        loads[i] += costs.get(module_name, default)
+        shards[i].append(module_name)
+    return shards[index - 1]
@@ -3,8 +3,13 @@
 import codecs
 import csv
 import importlib
+import json
+import multiprocessing
 import os
 import re
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, timedelta
 from inspect import getsource
 from io import StringIO
@@ -13,14 +18,26 @@ from urllib.parse import urlsplit
 import lxml.html
 import requests
 from invoke import task
-from opencivicdata.divisions import Division
+from pupa import settings
 from unidecode import unidecode
 
+from division_index import division_index
+from runner import (
+    Runner,
+    enable_host_coordinator,
+    merge_outputs,
+    print_summary,
+    read_report,
+    write_failures,
+    write_report,
+)
+from scheduler import History, Scheduler, parse_shard, shard_modules
+from work_queue import QueueRunner, WorkQueue
+
 # Map Standard Geographical Classification codes to the OCD identifiers of provinces and territories.
 province_or_territory_abbreviation_memo = {}
 # Map OpenCivicData Division Identifier to Census type name.
 ocdid_to_type_name_map = {}
-ocd_division_csv = os.path.join(os.path.abspath(os.path.dirname(__file__)), "country-ca.csv")
 
 
 def module_names():
@@ -73,9 +90,8 @@ def slug(name):
 
 def province_or_territory_abbreviation(code):
     if not province_or_territory_abbreviation_memo:
-        for division in Division.all("ca", from_csv=ocd_division_csv):
-            if division._type in ("province", "territory"):
-                province_or_territory_abbreviation_memo[division.attrs["sgc"]] = type_id(division.id)
+        for division in division_index.all("province", "territory"):
+            province_or_territory_abbreviation_memo[division.attrs["sgc"]] = type_id(division.id)
     return province_or_territory_abbreviation_memo[type_id(code)[:2]]
 
 
@@ -110,13 +126,13 @@ def get_definition(division_id, aggregation=False):
             census_subdivision_type_names[code] = name.split(" / ", 1)[0]
 
         # Map OCD identifiers to census types.
-        for division in Division.all("ca", from_csv=ocd_division_csv):
+        for division in division_index.all("cd", "csd"):
             if division._type == "cd":
                 ocdid_to_type_name_map[division.id] = census_division_type_names[division.attrs["classification"]]
             elif division._type == "csd":
                 ocdid_to_type_name_map[division.id] = census_subdivision_type_names[division.attrs["classification"]]
 
-    division = Division.get(division_id, from_csv=ocd_division_csv)
+    division = division_index.get(division_id)
     ocd_type_id = type_id(division.id)
 
     expected = {}
@@ -198,6 +214,414 @@ def get_definition(division_id, aggregation=False):
     return expected
 
 
+@task
+def divisions_index():
+    """
+    Compiles the OCD-IDs CSV into the division index.
+    """
+    division_index.build()
+    print("Wrote {}".format(division_index.path))
+
+
+@task
+def update(
+    modules="",
+    processes=0,
+    timeout=1800,
+    actions="",
+    datadir="",
+    schedule=False,
+    shard="",
+    prefetch=False,
+    probe=False,
+):
+    """
+    Runs `pupa update` for many jurisdictions in parallel, and prints a summary.
+
+    Set `modules` to a comma-separated list of modules (all by default), and
+    `actions` to "scrape" or "import" (both by default). Logs and a JSON report
+    are written to `datadir`/_logs, and the run history to
+    `datadir`/_history.sqlite3.
+
+    With `schedule`, jurisdictions are run longest first, and jurisdictions
+    whose sources rarely change are skipped until they are due, unless their
+    entry page or code changed (see `probe_entry_sources`).
+
+    With `shard` like "2/4", only the second of four shards of jurisdictions,
+    of similar total run time according to `datadir`/_shard_costs.json, is run.
+    Every node must have the same costs file, which `invoke merge` writes.
+
+    With `probe`, CSV jurisdictions whose sources and code are unchanged since
+    their last successful import are skipped (see `invoke probe`).
+
+    With `prefetch`, the jurisdictions' entry pages are fetched concurrently
+    before any jurisdiction runs (see `invoke prefetch`), and reused.
+    """
+    if modules:
+        names = modules.split(",")
+    else:
+        names = sorted(module_names())
+    runner = Runner(
+        processes=processes or None,
+        timeout=timeout,
+        actions=[action for action in actions.split(",") if action],
+        datadir=datadir or None,
+    )
+    history = History(os.path.join(runner.datadir, "_history.sqlite3"))
+
+    if shard:
+        costs_path = os.path.join(runner.datadir, "_shard_costs.json")
+        costs = {}
+        if os.path.exists(costs_path):
+            with open(costs_path) as f:
+                costs = json.load(f)
+        names = shard_modules(names, *parse_shard(shard), costs)
+
+    # Probe and prefetch in other processes, so that the workers don't inherit the imported scrapers.
+    start = time.time()
+    skipped = []
+    if schedule:
+        scheduler = Scheduler(history)
+        names, skipped = scheduler.plan(names)
+        if skipped:
+            # Run the jurisdictions that aren't due anyway, if a cheap probe finds a change.
+            with multiprocessing.get_context("fork").Pool(1) as pool:
+                changed = pool.apply(probe_entry_sources, (skipped, runner.datadir))
+            names = scheduler.order(names + changed)
+            for name in skipped:
+                if name not in changed:
+                    print("{:<45} skipped (sources rarely change)".format(name))
+
+    if probe:
+        with multiprocessing.get_context("fork").Pool(1) as pool:
+            changed, unchanged = pool.apply(probe_csv_sources, (names, runner.datadir))
+        names = [name for name in names if name not in unchanged]
+
+    if prefetch:
+        process = multiprocessing.get_context("fork").Process(target=prefetch_entry_urls, args=(names,))
+        process.start()
+        process.join()
+
+    if probe or prefetch or skipped:
+        # Reuse the sources fetched above. The workers read this setting when they import `utils`.
+        os.environ["HTTP_CACHE_SINCE"] = str(start)
+
+    run_batch(runner, runner.run(names), history)
+
+
+def run_batch(runner, results, history, rerun=False):
+    """
+    Records and prints the results of the runner as they finish, and prints and
+    writes a summary.
+
+    With `rerun`, the results replace those of the same jurisdictions in the
+    last batch's report, so that the report covers the whole batch.
+    """
+    start = time.time()
+    finished = []
+    for result in results:
+        changed = history.record(result)
+        print("{:<45} {}{}".format(result["module"], result["status"], " (changed)" if changed else ""))
+        finished.append(result)
+    seconds = time.time() - start
+
+    print_summary(finished, seconds)
+    report_path = os.path.join(runner.logdir, "report.json")
+    results = finished
+    if rerun and os.path.exists(report_path):
+        report = read_report(report_path)
+        names = {result["module"] for result in finished}
+        results = [result for result in report["results"] if result["module"] not in names] + finished
+        seconds += report["seconds"]
+    write_report(report_path, results, seconds)
+    write_failures(os.path.join(runner.logdir, "failures.json"), finished, start)
+
+
+@task
+def rerun_failed(processes=0, timeout=1800, actions="", datadir="", warm=False):
+    """
+    Runs again the jurisdictions that failed in the last batch, according to
+    `datadir`/_logs/failures.json. Their results replace the failed results in
+    the batch's report, `datadir`/_logs/report.json.
+
+    With `warm`, responses received since the failed batch started are reused
+    without requesting them again, so that the jurisdictions recover quickly
+    from a transient failure. See `invoke update` for the other options.
+    """
+    runner = Runner(
+        processes=processes or None,
+        timeout=timeout,
+        actions=[action for action in actions.split(",") if action],
+        datadir=datadir or None,
+    )
+    with open(os.path.join(runner.logdir, "failures.json")) as f:
+        ledger = json.load(f)
+    names = [failure["module"] for failure in ledger["failures"]]
+    if not names:
+        print("No failed jurisdictions")
+        return
+
+    if warm:
+        # The workers read this setting when they import `utils`.
+        os.environ["HTTP_CACHE_SINCE"] = str(ledger["start"])
+    history = History(os.path.join(runner.datadir, "_history.sqlite3"))
+    run_batch(runner, runner.run(names), history, rerun=True)
+
+
+@task
+def enqueue(queue, modules="", batch="", schedule=False, datadir=""):
+    """
+    Adds jurisdictions to a new batch in the work queue at the path `queue`,
+    longest first according to the history in `datadir`, for `invoke work`.
+
+    Set `modules` to a comma-separated list of modules (all by default). With
+    `schedule`, jurisdictions whose sources rarely change are skipped.
+    """
+    if modules:
+        names = modules.split(",")
+    else:
+        names = sorted(module_names())
+    history = History(os.path.join(datadir or settings.SCRAPED_DATA_DIR, "_history.sqlite3"))
+    if schedule:
+        names, skipped = Scheduler(history).plan(names)
+        print("Skipped {} jurisdictions whose sources rarely change".format(len(skipped)))
+    else:
+        names = Scheduler(history).order(names)
+
+    batch = batch or time.strftime("%Y-%m-%dT%H:%M:%S")
+    WorkQueue(queue).enqueue(batch, names)
+    print("Enqueued {} jurisdictions in batch {}".format(len(names), batch))
+
+
+@task
+def work(queue, batch="", processes=0, timeout=1800, actions="", datadir="", lease=120):
+    """
+    Runs jurisdictions leased from a batch in the work queue at the path
+    `queue` (the latest batch by default), until the batch is finished. Run
+    this on any number of nodes, then merge their outputs with `invoke merge`.
+
+    A leased jurisdiction is requeued if its worker doesn't renew its lease for
+    `lease` seconds. See `invoke update` for the other options.
+    """
+    work_queue = WorkQueue(queue)
+    batch = batch or work_queue.latest_batch()
+    runner = QueueRunner(
+        work_queue,
+        batch,
+        lease_seconds=lease,
+        processes=processes or None,
+        timeout=timeout,
+        actions=[action for action in actions.split(",") if action],
+        datadir=datadir or None,
+    )
+    history = History(os.path.join(runner.datadir, "_history.sqlite3"))
+    run_batch(runner, runner.run(), history)
+
+
+@task
+def queue_stats(queue, batch=""):
+    """
+    Prints the throughput and straggler tail of a batch in the work queue.
+    """
+    work_queue = WorkQueue(queue)
+    stats = work_queue.stats(batch or work_queue.latest_batch())
+    print(json.dumps(stats, indent=2, sort_keys=True))
+
+
+@task
+def merge(sources, datadir=""):
+    """
+    Merges the outputs, reports and histories of `invoke update --shard` runs.
+
+    Set `sources` to a comma-separated list of copies of each node's data
+    directory. The outputs are merged into `datadir`, where they can be
+    imported with `invoke update --actions=import`. The shard costs file, to be
+    copied to every node, is written from the merged history.
+    """
+    datadir = datadir or settings.SCRAPED_DATA_DIR
+    sources = sources.split(",")
+    names = merge_outputs(sources, datadir)
+
+    history = History(os.path.join(datadir, "_history.sqlite3"))
+    for source in sources:
+        path = os.path.join(source, "_history.sqlite3")
+        if os.path.exists(path) and os.path.realpath(path) != os.path.realpath(history.path):
+            history.merge(path)
+    costs_path = os.path.join(datadir, "_shard_costs.json")
+    with open(costs_path, "w") as f:
+        json.dump(history.costs(), f, indent=2, sort_keys=True)
+
+    print("Merged {} jurisdictions into {}. To import them:".format(len(names), datadir))
+    print("    invoke update --actions=import --datadir={} --modules={}".format(datadir, ",".join(names)))
+    print("Copy {} to every node.".format(costs_path))
+
+
+def entry_urls(names):
+    """
+    Returns the modules' names, person scraper classes, entry URLs and request
+    headers: the `csv_url` of CSV scrapers, or else the `COUNCIL_PAGE`, with
+    the headers with which the scraper requests it.
+    """
+    for module_name in names:
+        module = importlib.import_module("{}.people".format(module_name))
+        class_name = next(key for key in module.__dict__.keys() if "PersonScraper" in key)
+        klass = module.__dict__[class_name]
+        if getattr(klass, "csv_url", None):
+            url = klass.csv_url
+            headers = None
+        else:
+            url = getattr(module, "COUNCIL_PAGE", None)
+            # As `lxmlize` requests it, with the custom user agent if the module uses one.
+            headers = {"User-Agent": getattr(module, "CUSTOM_USER_AGENT", requests.utils.default_user_agent())}
+        if url and urlsplit(url).scheme in ("http", "https"):
+            yield module_name, klass, url, headers
+
+
+def build_scraper(module_name, klass, datadir=None):
+    """
+    Returns an instance of the module's scraper class, as `pupa update` would create it.
+    """
+    metadata = module_name_to_metadata(module_name)
+    jurisdiction = getattr(importlib.import_module(module_name), metadata["class_name"])()
+    return klass(jurisdiction, os.path.join(datadir or settings.SCRAPED_DATA_DIR, module_name))
+
+
+def prefetch_entry_urls(names, workers=16):
+    """
+    Fetches the modules' entry URLs concurrently into the HTTP cache, and
+    prints the failures by host. Returns the failures.
+    """
+    enable_host_coordinator()
+
+    def fetch(module_name, klass, url, headers):
+        # Use the scraper's own settings, e.g. its `host_settings`, and headers, so that it reuses the response.
+        scraper = build_scraper(module_name, klass)
+        try:
+            scraper.get(url, headers=headers)
+        except Exception as e:
+            return {"module": module_name, "url": url, "error": "{}: {}".format(type(e).__name__, e)}
+
+    start = time.time()
+    jobs = list(entry_urls(names))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        failures = [failure for failure in executor.map(lambda job: fetch(*job), jobs) if failure]
+
+    seconds = time.time() - start
+    print("Prefetched {} of {} entry URLs in {:.0f}s".format(len(jobs) - len(failures), len(jobs), seconds))
+    hosts = defaultdict(list)
+    for failure in failures:
+        hosts[urlsplit(failure["url"]).netloc].append(failure)
+    for host, host_failures in sorted(hosts.items(), key=lambda item: -len(item[1])):
+        print("{} ({} failed)".format(host, len(host_failures)))
+        for failure in host_failures:
+            print("    {:<45} {}".format(failure["module"], failure["error"]))
+    return failures
+
+
+@task
+def prefetch(modules="", workers=16):
+    """
+    Fetches the entry pages of jurisdictions (all by default) concurrently into
+    the HTTP cache, and prints the failures by host.
+    """
+    if modules:
+        names = modules.split(",")
+    else:
+        names = sorted(module_names())
+    prefetch_entry_urls(names, workers)
+
+
+def probe_csv_sources(names, datadir=None, workers=16):
+    """
+    Probes the sources of the modules' CSV scrapers concurrently, and prints the
+    jurisdictions whose sources or code changed since their last successful
+    import, and why. Returns the changed and the unchanged CSV jurisdictions.
+    Other jurisdictions aren't probed.
+    """
+    enable_host_coordinator()
+
+    def probe(module_name):
+        module = importlib.import_module("{}.people".format(module_name))
+        class_name = next(key for key in module.__dict__.keys() if "PersonScraper" in key)
+        klass = module.__dict__[class_name]
+        if klass.__bases__[0].__name__ != "CSVScraper":
+            return module_name, False, None
+        try:
+            return module_name, True, build_scraper(module_name, klass, datadir).probe()
+        except Exception as e:
+            return module_name, True, "probe failed: {}: {}".format(type(e).__name__, e)
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = [(module_name, reason) for module_name, probed, reason in executor.map(probe, names) if probed]
+    seconds = time.time() - start
+
+    changed = [module_name for module_name, reason in results if reason]
+    unchanged = [module_name for module_name, reason in results if not reason]
+    for module_name, reason in results:
+        if reason:
+            print("{:<45} {}".format(module_name, reason))
+    print(
+        "Probed {} CSV jurisdictions in {:.0f}s: {} changed, {} unchanged".format(
+            len(results), seconds, len(changed), len(unchanged)
+        )
+    )
+    return changed, unchanged
+
+
+def probe_entry_sources(names, datadir=None, workers=16):
+    """
+    Probes the entry pages of the modules (see `entry_urls`) concurrently, and
+    prints the jurisdictions whose entry page or code changed since their last
+    run, and why. Returns the changed jurisdictions. A jurisdiction without an
+    entry page to probe counts as changed.
+    """
+    enable_host_coordinator()
+
+    def probe(job):
+        module_name, klass, url, headers = job
+        try:
+            return module_name, build_scraper(module_name, klass, datadir).probe_entry(url)
+        except Exception as e:
+            return module_name, "probe failed: {}: {}".format(type(e).__name__, e)
+
+    start = time.time()
+    jobs = list(entry_urls(names))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(probe, jobs))
+    seconds = time.time() - start
+
+    probed = {job[0] for job in jobs}
+    changed = [module_name for module_name in names if module_name not in probed]
+    for module_name in changed:
+        print("{:<45} no entry page to probe".format(module_name))
+    for module_name, reason in results:
+        if reason:
+            print("{:<45} {}".format(module_name, reason))
+            changed.append(module_name)
+    print("Probed {} entry pages in {:.0f}s: {} jurisdictions to run".format(len(results), seconds, len(changed)))
+    return changed
+
+
+@task
+def probe(modules="", datadir="", workers=16):
+    """
+    Probes the sources of CSV jurisdictions (all by default) concurrently, and
+    prints the jurisdictions whose sources or code changed since their last
+    successful import, to run with `invoke update --modules`.
+
+    To probe and skip unchanged CSV jurisdictions in a batch, add `--probe` to
+    `invoke update`.
+    """
+    if modules:
+        names = modules.split(",")
+    else:
+        names = sorted(module_names())
+    changed, unchanged = probe_csv_sources(names, datadir or None, workers)
+    if changed:
+        print("    invoke update --modules={}".format(",".join(changed)))
+
+
 @task
 def council_pages():
     """
@@ -405,7 +829,7 @@ def validate_spreadsheet(url, identifier_header, geographic_name_header):
     """
     sgc_to_id = {}
 
-    for division in Division.all("ca", from_csv=ocd_division_csv):
+    for division in division_index.all():
         sgc_to_id[division.attrs["sgc"]] = division.id
 
     reader = csv_dict_reader(url)
@@ -419,7 +843,7 @@ def validate_spreadsheet(url, identifier_header, geographic_name_header):
         elif len(identifier) == 7:
             identifier = "ocd-division/country:ca/csd:{}".format(identifier)
 
-        division = Division.get(identifier)
+        division = division_index.get(identifier)
         if row[geographic_name_header] != division.name:
             print("{}: name: {} not {}".format(identifier, division.name, row[geographic_name_header]))
 
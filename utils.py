@@ -1,25 +1,44 @@
 # coding: utf-8
 
+import codecs
+import copy
 import csv
+import difflib
+import glob
+import hashlib
+import inspect
+import json
+import logging
 import os
+import pickle
 import re
-from collections import defaultdict
+import shutil
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from email.utils import mktime_tz, parsedate_tz
 from ftplib import FTP
+from functools import lru_cache, wraps
 from io import BytesIO, StringIO
 from urllib.parse import unquote, urlparse
-from zipfile import ZipFile
+from zipfile import ZIP_DEFLATED, ZipFile
 
 import agate
 import agateexcel  # noqa
 import lxml.html
 import requests
 from lxml import etree
-from opencivicdata.divisions import Division
+from pupa import settings
 from pupa.scrape import Jurisdiction, Organization, Person, Post, Scraper
+from pupa.utils import utcnow
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
+from unidecode import unidecode
 
 import patch  # patch patches validictory # noqa
+from division_index import division_index
+from host_coordinator import host_coordinator
 
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
@@ -89,18 +108,81 @@ if os.getenv("SSL_VERIFY", False):
 else:
     SSL_VERIFY = bool(os.getenv("SSL_VERIFY", False))
 
+# Set to "record" to record responses to an archive per jurisdiction, or to "replay" to replay them.
+HTTP_FIXTURES = os.getenv("HTTP_FIXTURES")
+# Set to scrape even if the sources are unchanged since the last run.
+FORCE_SCRAPE = os.getenv("FORCE_SCRAPE")
+# Set to a Unix time to reuse responses cached since that time without requesting them again.
+HTTP_CACHE_SINCE = float(os.getenv("HTTP_CACHE_SINCE", 0))
+# The number of seconds after which to delete a cached response that wasn't revalidated.
+HTTP_CACHE_PRUNE_AGE = int(os.getenv("HTTP_CACHE_PRUNE_AGE", 30 * 24 * 3600))
+# The number of seconds after which to delete a cached extraction that wasn't used.
+EXTRACTIONS_MAX_AGE = int(os.getenv("EXTRACTIONS_MAX_AGE", 30 * 24 * 3600))
+
 email_re = re.compile(r"([A-Za-z0-9._-]+@(?:[A-Za-z0-9-]+\.)+[A-Za-z]{2,})")
 
 
-styles_of_address = {}
-for gid in range(3):
-    response = requests.get(
-        "https://docs.google.com/spreadsheets/d/11qUKd5bHeG5KIzXYERtVgs3hKcd9yuZlt-tCTLBFRpI/pub?single=true&gid={}&output=csv".format(
-            gid
-        ),
-        verify=SSL_VERIFY,
-    )
-    if response.status_code == 200:
+STYLES_OF_ADDRESS_URL = "https://docs.google.com/spreadsheets/d/11qUKd5bHeG5KIzXYERtVgs3hKcd9yuZlt-tCTLBFRpI/pub?single=true&gid={}&output=csv"
+# The format version of the styles of address snapshot file.
+STYLES_OF_ADDRESS_VERSION = 1
+# The number of seconds after which to refresh the styles of address snapshot file.
+STYLES_OF_ADDRESS_TTL = int(os.getenv("STYLES_OF_ADDRESS_TTL", 86400))
+
+logger = logging.getLogger(__name__)
+
+styles_of_address_memo = {}
+
+
+def styles_of_address():
+    """
+    Returns the styles of address of leaders and members by division identifier.
+
+    The styles are read from a local snapshot, which is refreshed from Google
+    Sheets if it is older than `STYLES_OF_ADDRESS_TTL` seconds. If the refresh
+    fails, a stale snapshot is used.
+    """
+    if not styles_of_address_memo:
+        path = os.path.join(settings.CACHE_DIR, "styles_of_address.json")
+
+        snapshot = None
+        try:
+            with open(path) as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") != STYLES_OF_ADDRESS_VERSION:
+                snapshot = None
+        except (OSError, ValueError):
+            pass
+
+        if not snapshot or time.time() - snapshot["updated_at"] > STYLES_OF_ADDRESS_TTL:
+            try:
+                snapshot = {
+                    "version": STYLES_OF_ADDRESS_VERSION,
+                    "updated_at": time.time(),
+                    "styles_of_address": download_styles_of_address(),
+                }
+            except requests.RequestException as e:
+                if not snapshot:
+                    raise
+                logger.warning("Using stale styles of address snapshot: {}".format(e))
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp = "{}.{}".format(path, os.getpid())
+                with open(tmp, "w") as f:
+                    json.dump(snapshot, f, ensure_ascii=False, indent=2, sort_keys=True)
+                os.replace(tmp, path)
+
+        styles_of_address_memo.update(snapshot["styles_of_address"])
+    return styles_of_address_memo
+
+
+def download_styles_of_address():
+    """
+    Downloads the styles of address of leaders and members by division identifier.
+    """
+    styles = {}
+    for gid in range(3):
+        response = requests.get(STYLES_OF_ADDRESS_URL.format(gid), verify=SSL_VERIFY)
+        response.raise_for_status()
         response.encoding = "utf-8"
         for row in csv.DictReader(StringIO(response.text)):
             identifier = row.pop("Identifier")
@@ -108,10 +190,741 @@ for gid in range(3):
                 if not row[field] or field == "Name":
                     row.pop(field)
             if row:
-                styles_of_address[identifier] = row
+                styles[identifier] = row
+    return styles
+
+
+def build_response(url, status_code, headers, body):
+    """
+    Returns a response that was not received over the network.
+    """
+    response = requests.Response()
+    response.status_code = status_code
+    response.url = url
+    response.headers = requests.structures.CaseInsensitiveDict(headers)
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = body
+    response.fromcache = True
+    return response
+
+
+# The response headers to store in the HTTP cache.
+CACHED_HEADERS = ("content-type", "etag", "last-modified")
+
+
+class HTTPCache(object):
+    """
+    Stores the body and validators (ETag, Last-Modified) of responses by URL,
+    so that requests can be made conditional and a 304 can reuse the body.
+
+    Responses without validators are stored too, so that, if `HTTP_CACHE_SINCE`
+    is set, e.g. to rerun failed scrapers, recent responses are reused.
+
+    Responses that weren't stored or revalidated for `max_age` seconds are
+    deleted, at most once every `prune_interval` seconds across processes.
+    """
+
+    def __init__(self, path, max_age=HTTP_CACHE_PRUNE_AGE, prune_interval=3600):
+        self.path = path
+        self.max_age = max_age
+        self.prune_interval = prune_interval
+        self.pruned = False
+
+    def _filename(self, url):
+        return os.path.join(self.path, hashlib.sha1(url.encode("utf-8")).hexdigest())
+
+    def get(self, url):
+        """
+        Returns the cached metadata and body for the URL, if any.
+        """
+        filename = self._filename(url)
+        try:
+            with open(filename + ".json") as f:
+                metadata = json.load(f)
+            with open(filename + ".body", "rb") as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None, None
+        # Processes caching the same URL at the same time can leave the body of one with the metadata of the other.
+        if "sha1" in metadata and hashlib.sha1(body).hexdigest() != metadata["sha1"]:
+            return None, None
+        return metadata, body
+
+    def set(self, url, response, request_headers=None):
+        """
+        Caches the response and the headers of its request. A fresh response is
+        reused without revalidation only by requests with the same headers.
+        """
+        metadata = {
+            "url": url,
+            "headers": {k.lower(): v for k, v in response.headers.items() if k.lower() in CACHED_HEADERS},
+            "request_headers": request_headers,
+            # Whether a HEAD request can tell if the body changed, as `probe` uses.
+            "length": None if response.headers.get("content-encoding") else response.headers.get("content-length"),
+            "sha1": hashlib.sha1(response.content).hexdigest(),
+            "stored_at": time.time(),
+        }
+
+        os.makedirs(self.path, exist_ok=True)
+        if not self.pruned:
+            self.pruned = True
+            self.prune()
+        filename = self._filename(url)
+        # Write to temporary files and rename, so that concurrent readers never see a partial entry.
+        suffix = "{}.{}".format(os.getpid(), threading.get_ident())
+        for extension, mode, content in ((".body", "wb", response.content), (".json", "w", metadata)):
+            tmp = "{}{}.{}".format(filename, extension, suffix)
+            try:
+                with open(tmp, mode) as f:
+                    if extension == ".json":
+                        json.dump(content, f)
+                    else:
+                        f.write(content)
+                os.replace(tmp, filename + extension)
+            except OSError:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+
+    def touch(self, url):
+        """
+        Records that the cached response is still current, so that it isn't pruned.
+        """
+        try:
+            os.utime(self._filename(url) + ".json")
+        except OSError:
+            pass
+
+    def prune(self):
+        """
+        Deletes the responses that weren't stored or revalidated for `max_age`
+        seconds, unless another process did so in the last `prune_interval` seconds.
+        """
+        stamp = os.path.join(self.path, "pruned")
+        try:
+            if time.time() - os.path.getmtime(stamp) < self.prune_interval:
+                return
+        except OSError:
+            pass
+        with open(stamp, "w"):
+            pass
+
+        cutoff = time.time() - self.max_age
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            filename = os.path.join(self.path, name)
+            try:
+                if os.path.getmtime(filename) < cutoff:
+                    # Delete the metadata first, so that a reader never finds metadata without its body.
+                    os.remove(filename)
+                    os.remove(filename[: -len(".json")] + ".body")
+            except OSError:
+                pass
+
+    @staticmethod
+    def conditional_headers(metadata):
+        headers = {}
+        if "etag" in metadata["headers"]:
+            headers["If-None-Match"] = metadata["headers"]["etag"]
+        if "last-modified" in metadata["headers"]:
+            headers["If-Modified-Since"] = metadata["headers"]["last-modified"]
+        return headers
+
+    @staticmethod
+    def response(metadata, body):
+        """
+        Returns a response for the cached metadata and body.
+        """
+        return build_response(metadata["url"], 200, metadata["headers"], body)
+
+
+http_cache = HTTPCache(os.path.join(settings.CACHE_DIR, "revalidation"))
+
+
+class HTTPArchive(object):
+    """
+    Records responses to, and replays responses from, a ZIP archive, so that a
+    scraper can run without network access.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(method, url, **kwargs):
+        """
+        Returns a key for the request, based on its method, URL, query string and body.
+        """
+        prepared = requests.Request(
+            method.upper(), url, params=kwargs.get("params"), data=kwargs.get("data"), json=kwargs.get("json")
+        ).prepare()
+        body = prepared.body or b""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        return hashlib.sha1("{} {}\n".format(prepared.method, prepared.url).encode("utf-8") + body).hexdigest()
+
+    def load(self):
+        with ZipFile(self.path) as zipfile:
+            for name in zipfile.namelist():
+                if name.endswith(".json"):
+                    key = name[:-5]
+                    self.entries[key] = (json.loads(zipfile.read(name).decode("utf-8")), zipfile.read(key + ".body"))
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = "{}.{}".format(self.path, os.getpid())
+        with self.lock, ZipFile(tmp, "w", ZIP_DEFLATED) as zipfile:
+            for key, (metadata, body) in sorted(self.entries.items()):
+                zipfile.writestr(key + ".json", json.dumps(metadata, sort_keys=True))
+                zipfile.writestr(key + ".body", body)
+        os.replace(tmp, self.path)
+
+    def get(self, key, description):
+        """
+        Returns the recorded metadata and body for the key, or raises an error.
+        """
+        try:
+            return self.entries[key]
+        except KeyError:
+            raise Exception("No recorded response for {} in {}".format(description, self.path))
+
+    def set(self, key, metadata, body):
+        with self.lock:
+            self.entries[key] = (metadata, body)
+
+    def replay(self, method, url, **kwargs):
+        metadata, body = self.get(self.key(method, url, **kwargs), "{} {}".format(method.upper(), url))
+        return build_response(metadata["url"], metadata["status_code"], metadata["headers"], body)
+
+    def record(self, method, url, response, **kwargs):
+        metadata = {
+            "method": method.upper(),
+            "url": response.url or url,
+            "status_code": response.status_code,
+            "headers": dict(response.headers),
+        }
+        self.set(self.key(method, url, **kwargs), metadata, response.content)
+
+
+class CharsetRegistry(object):
+    """
+    Stores the charset guessed for each URL, so that later runs needn't guess.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.charsets = None
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def get(self, url):
+        with self.lock:
+            if self.charsets is None:
+                self.charsets = self._load()
+            return self.charsets.get(url)
+
+    def set(self, url, charset):
+        with self.lock:
+            if self.charsets is None:
+                self.charsets = self._load()
+            self.charsets[url] = charset
+            self.changed = True
+
+    def save(self):
+        with self.lock:
+            if not self.changed:
+                return
+            # Merge with charsets recorded by other processes since loading.
+            charsets = self._load()
+            charsets.update(self.charsets)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = "{}.{}".format(self.path, os.getpid())
+            with open(tmp, "w") as f:
+                json.dump(charsets, f, indent=2, sort_keys=True)
+            os.replace(tmp, self.path)
+            self.changed = False
+
+
+charset_registry = CharsetRegistry(os.path.join(settings.CACHE_DIR, "charsets.json"))
+
+
+class ScrapeSnapshot(object):
+    """
+    Stores a scraper's output files, with the hashes of the sources and code
+    from which they were scraped, so that they can be reused if none changed.
+
+    Files are hard-linked, so that storing and restoring them is cheap.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.manifest_path = os.path.join(path, "manifest.json")
+
+    def load(self):
+        try:
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, manifest):
+        tmp = "{}.{}".format(self.manifest_path, os.getpid())
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.manifest_path)
+
+    def save(self, datadir, signature, sources, output_names, record):
+        os.makedirs(self.path, exist_ok=True)
+        if os.path.exists(self.manifest_path):
+            os.unlink(self.manifest_path)
+        for filename in os.listdir(self.path):
+            os.unlink(os.path.join(self.path, filename))
+
+        filenames = sorted(filename for names in output_names.values() for filename in names)
+        for filename in filenames:
+            link(os.path.join(datadir, filename), os.path.join(self.path, filename))
+        self._write(
+            {
+                "signature": signature,
+                "sources": sources,
+                "files": filenames,
+                "objects": record["objects"],
+                # Set once the output is imported.
+                "imported": False,
+            }
+        )
+
+    def restore(self, datadir):
+        """
+        Links the stored files into the directory. Returns whether all files were stored.
+        """
+        manifest = self.load()
+        if not all(os.path.exists(os.path.join(self.path, filename)) for filename in manifest["files"]):
+            return False
+        for filename in manifest["files"]:
+            link(os.path.join(self.path, filename), os.path.join(datadir, filename))
+        return True
+
+    @staticmethod
+    def mark_imported(datadir):
+        """
+        Records that the snapshots of a jurisdiction's scrapers were imported.
+        """
+        for path in glob.glob(os.path.join(datadir, "_snapshots", "*")):
+            snapshot = ScrapeSnapshot(path)
+            manifest = snapshot.load()
+            if manifest and not manifest["imported"]:
+                manifest["imported"] = True
+                snapshot._write(manifest)
+
+
+class UnitCheckpoint(object):
+    """
+    Stores the objects scraped from each unit of an aggregate scraper's crawl,
+    e.g. each municipality, and the scraper's state after the last unit, so
+    that an unfinished crawl can resume (see `CanadianScraper.scrape_units`).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.state_path = os.path.join(path, "state.pickle")
+        self.errors_path = os.path.join(path, "errors.json")
+
+    def _filename(self, key):
+        return os.path.join(self.path, "{}.pickle".format(hashlib.sha1(key.encode("utf-8")).hexdigest()))
+
+    def _read(self, filename):
+        try:
+            with open(filename, "rb") as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _write(self, filename, value):
+        os.makedirs(self.path, exist_ok=True)
+        tmp = "{}.{}".format(filename, os.getpid())
+        with open(tmp, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp, filename)
+
+    def load(self, signature, max_age):
+        """
+        Returns the scraper's state after the last completed unit, or clears the
+        checkpoints and returns `None` if they are from other code or too old.
+        """
+        state = self._read(self.state_path)
+        if state and state["signature"] == signature and time.time() - state["updated_at"] < max_age:
+            return state["attributes"]
+        self.clear()
+
+    def get(self, key):
+        """
+        Returns the objects scraped from the unit, if it was completed.
+        """
+        return self._read(self._filename(key))
+
+    def set(self, key, objects, signature, attributes):
+        self._write(self._filename(key), objects)
+        self._write(self.state_path, {"signature": signature, "updated_at": time.time(), "attributes": attributes})
+
+    def write_errors(self, errors):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.errors_path, "w") as f:
+            json.dump(errors, f, indent=2)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
+
+def link(source, destination):
+    """
+    Hard-links the file, or copies it if it can't be hard-linked.
+    """
+    if os.path.exists(destination):
+        os.unlink(destination)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def file_sha1(path):
+    """
+    Returns the SHA-1 hash of the file's content, computing it once per process.
+    """
+    if path not in file_sha1_memo:
+        with open(path, "rb") as f:
+            file_sha1_memo[path] = hashlib.sha1(f.read()).hexdigest()
+    return file_sha1_memo[path]
+
+
+class LRUCache(object):
+    """
+    A thread-safe cache that evicts the least recently used values once their
+    total size exceeds `max_size` bytes.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key][0]
+
+    def set(self, key, value, size):
+        if size > self.max_size:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+
+
+class HostLimiter(object):
+    """
+    Limits the concurrency and rate of requests to a host, adapting the
+    concurrency limit by additive increase and multiplicative decrease (AIMD).
+
+    The limit increases by about one per round trip while responses are fast.
+    It halves, at most once per round trip, on an error, a 429 or 503, or a
+    response slower than `slow_factor` times the fastest response so far.
+    """
+
+    # How many times slower than the fastest response a response must be to count as slow.
+    slow_factor = 4
+
+    def __init__(self, host, concurrency=2, max_concurrency=8, requests_per_minute=0, max_retry_after=300):
+        self.host = host
+        self.limit = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0
+        self.max_retry_after = max_retry_after
+        self.in_flight = 0
+        self.not_before = 0
+        self.min_latency = None
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while True:
+                delay = self.not_before - time.time()
+                if delay > 0:
+                    self.condition.wait(delay)
+                elif self.in_flight >= int(self.limit):
+                    self.condition.wait()
+                else:
+                    break
+            self.in_flight += 1
+            if self.interval:
+                self.not_before = time.time() + self.interval
+
+    def release(self, latency, status_code=None, retry_after=None):
+        """
+        Records the outcome of a request. `status_code` is `None` if the request failed.
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.time()
+            if status_code is None or status_code in (429, 503):
+                self._decrease(now, latency)
+                seconds = parse_retry_after(retry_after) if retry_after else None
+                if seconds is not None:
+                    seconds = min(seconds, self.max_retry_after)
+                    logger.warning("%s: %s, waiting %ds (Retry-After)", self.host, status_code, seconds)
+                    self.not_before = max(self.not_before, now + seconds)
+            else:
+                if self.min_latency is None or latency < self.min_latency:
+                    self.min_latency = latency
+                if latency > self.slow_factor * self.min_latency:
+                    self._decrease(now, latency)
+                else:
+                    self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+    def _decrease(self, now, latency):
+        # Responses to requests sent before the last decrease reflect the old limit.
+        if now - self.last_decrease > latency:
+            self.limit = max(1.0, self.limit / 2)
+            self.last_decrease = now
+
+
+class CircuitBreakerOpen(requests.exceptions.ConnectionError):
+    pass
+
+
+class CircuitBreakers(object):
+    """
+    Counts consecutive connection failures and timeouts by host, across all
+    scrapers in the process.
+
+    After `threshold` consecutive failures, the host's circuit opens: requests
+    to the host fail at once. After `cooldown` seconds, one request is let
+    through. If it succeeds, the circuit closes; otherwise, it stays open for
+    another `cooldown` seconds.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.failures = Counter()
+        self.opened_at = {}
+
+    def check(self, host, cooldown):
+        """
+        Raises `CircuitBreakerOpen` if the host's circuit is open.
+        """
+        with self.lock:
+            opened_at = self.opened_at.get(host)
+            if opened_at is None:
+                return
+            remaining = opened_at + cooldown - time.time()
+            if remaining <= 0:
+                # Let this request through, and fail others until its outcome is known.
+                self.opened_at[host] = time.time()
+                return
+            raise CircuitBreakerOpen(
+                "{} failed {} consecutive times; not requesting it for {:.0f}s".format(
+                    host, self.failures[host], remaining
+                )
+            )
+
+    def failure(self, host, threshold):
+        with self.lock:
+            self.failures[host] += 1
+            if host in self.opened_at or self.failures[host] >= threshold:
+                if host not in self.opened_at:
+                    logger.error("%s failed %d consecutive times, opening circuit", host, self.failures[host])
+                self.opened_at[host] = time.time()
+
+    def success(self, host):
+        with self.lock:
+            self.failures.pop(host, None)
+            if self.opened_at.pop(host, None) is not None:
+                logger.info("%s recovered, closing circuit", host)
+
+
+circuit_breakers = CircuitBreakers()
+
+
+class HostLimitingAdapter(requests.adapters.HTTPAdapter):
+    """
+    Sends each attempt of a request, including scrapelib's retries, through
+    the limiter of the request's host, and reports connection failures and
+    timeouts to the host's circuit breaker.
+    """
+
+    def __init__(self, scraper, **kwargs):
+        super().__init__(**kwargs)
+        self.scraper = scraper
+
+    def send(self, request, **kwargs):
+        host = urlparse(request.url).netloc
+        limiter = self.scraper.host_limiter(host)
+        limiter.acquire()
+        start = time.time()
+        try:
+            # Wait for a slot shared with other processes, if coordinated.
+            requests_per_minute = self.scraper.host_option(host, "global_host_requests_per_minute")
+            with host_coordinator.slot(
+                host,
+                self.scraper.host_option(host, "global_host_concurrency"),
+                60.0 / requests_per_minute if requests_per_minute else 0,
+            ):
+                start = time.time()
+                response = super().send(request, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            limiter.release(time.time() - start)
+            circuit_breakers.failure(host, self.scraper.circuit_breaker_threshold)
+            raise
+        except Exception:
+            limiter.release(time.time() - start)
+            raise
+        retry_after = response.headers.get("Retry-After")
+        limiter.release(time.time() - start, response.status_code, retry_after)
+        if response.status_code in (429, 503) and retry_after:
+            seconds = parse_retry_after(retry_after)
+            if seconds is not None:
+                host_coordinator.pause(host, min(seconds, limiter.max_retry_after))
+        circuit_breakers.success(host)
+        return response
 
 
 class CanadianScraper(Scraper):
+    # Whether to make GET requests conditional on the ETag and Last-Modified
+    # headers of the previous response, and to reuse its body on a 304.
+    revalidate = True
+    # The initial number of concurrent requests to a host. The number adapts to
+    # the host's responses, between 1 and `max_host_concurrency`.
+    host_concurrency = 2
+    # The maximum number of concurrent requests to a host.
+    max_host_concurrency = 8
+    # The maximum number of requests per minute to a host (0 for no maximum). By
+    # default, scrapelib's `SCRAPELIB_RPM`, or no maximum in fastmode.
+    host_requests_per_minute = None
+    # The longest `Retry-After` delay to honour, in seconds.
+    max_retry_after = 300
+    # Set the above by host, e.g. `{"www.example.ca": {"max_host_concurrency": 1}}`.
+    host_settings = {}
+    # If processes coordinate their requests (see `host_coordinator.py`), the
+    # maximum number of concurrent requests to a host across all processes.
+    global_host_concurrency = 4
+    # If processes coordinate their requests, the maximum number of requests per
+    # minute to a host across all processes (0 for no maximum).
+    global_host_requests_per_minute = 0
+    # The number of consecutive connection failures or timeouts to a host after
+    # which to fail requests to the host at once. The count is shared by all
+    # scrapers in the process.
+    circuit_breaker_threshold = 5
+    # The number of seconds for which to fail requests to a failing host, before
+    # trying it again.
+    circuit_breaker_cooldown = 300
+    # The maximum size in bytes of the response bodies and parsed pages to reuse
+    # within a run, if the same URL is requested again.
+    memo_max_size = 64 * 1024 * 1024
+    # Whether to reuse the output of the last run, instead of scraping, if the
+    # sources it requested and the code that scraped them are unchanged.
+    reuse_unchanged_output = True
+    # The attributes of an aggregate scraper that carry state from one unit of a
+    # crawl to the next, e.g. a set of processed divisions, to restore when the
+    # crawl resumes (see `scrape_units`).
+    checkpoint_attributes = ()
+    # The number of seconds after which to discard an unfinished crawl's checkpoints.
+    checkpoint_max_age = 24 * 3600
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # The host limiters replace scrapelib's throttle, which spaces out all requests, to any host, by the same
+        # interval (`SCRAPELIB_RPM`), so that requests to different hosts don't wait for each other. Each host is
+        # still limited to that rate, unless `host_requests_per_minute` or `host_settings` lifts the limit.
+        if self.host_requests_per_minute is None:
+            self.host_requests_per_minute = self.requests_per_minute
+        self.requests_per_minute = 0
+        # Send the user agent that `lxmlize` sends by default with other requests too.
+        self.user_agent = requests.utils.default_user_agent()
+        self._host_limiters_lock = threading.Lock()
+        self.host_limiters = {}
+        adapter = HostLimitingAdapter(self)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self._stats_lock = threading.Lock()
+        self.http_cache_stats = Counter()
+        self.memo = LRUCache(self.memo_max_size)
+        self.memo_stats = Counter()
+        self.bytes_fetched = 0
+        # The hashes of the sources requested in this run.
+        self.sources = OrderedDict()
+        self.sources_complete = True
+
+        # Record or replay responses, if requested.
+        self.http_archive = None
+        if HTTP_FIXTURES in ("record", "replay"):
+            self.http_archive = HTTPArchive(
+                os.path.join(settings.FIXTURES_DIR, "{}.zip".format(self.jurisdiction.__class__.__module__))
+            )
+            if HTTP_FIXTURES == "replay":
+                self.http_archive.load()
+
+    def host_option(self, host, name):
+        """
+        Returns the host's setting in `host_settings`, or the scraper's default.
+        """
+        return self.host_settings.get(host, {}).get(name, getattr(self, name))
+
+    def host_limiter(self, host):
+        """
+        Returns the limiter of requests to the host.
+        """
+        with self._host_limiters_lock:
+            if host not in self.host_limiters:
+                self.host_limiters[host] = HostLimiter(
+                    host,
+                    concurrency=self.host_option(host, "host_concurrency"),
+                    max_concurrency=self.host_option(host, "max_host_concurrency"),
+                    requests_per_minute=self.host_option(host, "host_requests_per_minute"),
+                    max_retry_after=self.host_option(host, "max_retry_after"),
+                )
+            return self.host_limiters[host]
+
+    @property
+    def telephone_number_normalizer(self):
+        """
+        Returns a telephone number normalizer for the jurisdiction's province or territory.
+        """
+        if not hasattr(self, "_telephone_number_normalizer"):
+            self._telephone_number_normalizer = TelephoneNumberNormalizer(
+                province_or_territory_abbreviation_of(self.jurisdiction.division_id)
+            )
+        return self._telephone_number_normalizer
+
+    def xpath(self, node, expression, **variables):
+        """
+        Evaluates the XPath expression on the node, compiling the expression
+        only once. Pass values as XPath variables, e.g.
+        `self.xpath(node, "//a[text() = $name]", name=name)`, rather than
+        formatting them into the expression, so that it is compiled only once.
+        """
+        return compiled_xpath(expression)(node, **variables)
+
     def get_email(self, node, expression=".", *, error=True):
         """
         Make sure that the node/expression is narrow enough to not capture a
@@ -120,15 +933,15 @@ class CanadianScraper(Scraper):
 
         matches = []
         # If the text would be split across multiple sub-tags.
-        for match in node.xpath('{}//*[contains(text(), "@")]'.format(expression)):
+        for match in self.xpath(node, '{}//*[contains(text(), "@")]'.format(expression)):
             matches.append(match.text_content())
         # The text version is more likely to be correct, as it is more visible,
         # e.g. ca_bc has one `href` of `mailto:first.last.mla@leg.bc.ca`.
-        for match in node.xpath('{}//a[contains(@href, "mailto:")]'.format(expression)):
+        for match in self.xpath(node, '{}//a[contains(@href, "mailto:")]'.format(expression)):
             matches.append(unquote(match.attrib["href"]))
         # If the node has no sub-tags.
         if not matches:
-            for match in node.xpath('{}//text()[contains(., "@")]'.format(expression)):
+            for match in self.xpath(node, '{}//text()[contains(., "@")]'.format(expression)):
                 matches.append(match)
         if matches:
             for match in matches:
@@ -143,94 +956,543 @@ class CanadianScraper(Scraper):
     def get_phone(self, node, *, area_codes=[], error=True):
         """
         Don't use if multiple telephone numbers are present, e.g. voice and fax.
-        If writing a new scraper, check that extensions are captured.
+        Use `get_phones` instead. If writing a new scraper, check that
+        extensions are captured.
         """
 
         if isinstance(node, etree._ElementUnicodeResult):
-            match = re.search(
-                r"(?:\A|\D)(\(?\d{3}\)?\D?\d{3}\D?\d{4}(?:\s*(?:/|x|ext[.:]?|poste)[\s-]?\d+)?)(?:\D|\Z)", node
-            )
+            match = telephone_number_candidate_re.search(node)
             if match:
-                return match.group(1)
-        match = node.xpath('.//a[contains(@href,"tel:")]')
+                return match.group("number")
+        match = self.xpath(node, './/a[contains(@href,"tel:")]')
         if match:
             return match[0].attrib["href"].replace("tel:", "")
+        # Scan the text once for candidates, then pick the first candidate by area code.
+        candidates = [
+            match.group("number", "area_code") for match in telephone_number_candidate_re.finditer(node.text_content())
+        ]
         if area_codes:
             for area_code in area_codes:
-                match = re.search(
-                    r"(?:\A|\D)(\(?%d\)?\D?\d{3}\D?\d{4}(?:\s*(?:/|x|ext[.:]?|poste)[\s-]?\d+)?)(?:\D|\Z)" % area_code,
-                    node.text_content(),
-                )
-                if match:
-                    return match.group(1)
-        else:
-            match = re.search(
-                r"(?:\A|\D)(\(?\d{3}\)?\D?\d{3}\D?\d{4}(?:\s*(?:/|x|ext[.:]?|poste)[\s-]?\d+)?)(?:\D|\Z)",
-                node.text_content(),
-            )
-            if match:
-                return match.group(1)
+                for number, candidate_area_code in candidates:
+                    if candidate_area_code == str(area_code):
+                        return number
+        elif candidates:
+            return candidates[0][0]
         if error:
             raise Exception("No phone pattern in {}".format(node.text_content()))
 
+    def get_phones(self, node):
+        """
+        Returns all telephone numbers, with extensions, in the node's text, in
+        the order in which they appear, in a single scan.
+        """
+        if isinstance(node, etree._ElementUnicodeResult):
+            text = node
+        else:
+            text = node.text_content()
+        numbers = []
+        end = 0
+        # The pattern matches overlapping numbers, so skip those that start within the previous number.
+        for match in telephone_number_candidate_re.finditer(text):
+            if match.start("number") >= end:
+                numbers.append(match.group("number"))
+                end = match.end("number")
+        return numbers
+
     def get_link(self, node, substring, *, error=True):
-        match = node.xpath('.//a[contains(@href,"{}")]/@href'.format(substring))
+        match = self.xpath(node, ".//a[contains(@href, $substring)]/@href", substring=substring)
         if match:
             return match[0]
         if error:
             raise Exception("No link matching {}".format(substring))
 
+    def request(self, method, url, **kwargs):
+        # The URL to report if scraping fails.
+        self.last_url = url
+
+        if HTTP_FIXTURES == "replay":
+            return self.http_archive.replay(method, url, **kwargs)
+
+        # Reuse the response to an identical GET request in this run.
+        key = None
+        if method.upper() == "GET" and not kwargs.get("stream") and not kwargs.get("cookies"):
+            prepared = requests.PreparedRequest()
+            prepared.prepare_url(url, kwargs.get("params"))
+            headers = self._request_headers(kwargs.get("headers"))
+            key = ("response", prepared.url, tuple(sorted(headers.items())))
+            response = self.memo.get(key)
+            if response is not None:
+                self._count_memo("response hits")
+                self._record_source("GET", prepared.url, kwargs.get("headers"), response.content)
+                # Copy the response, in case the caller sets its encoding.
+                return copy.copy(response)
+            self._count_memo("response misses")
+
+        # Fail at once if the host is down, rather than retrying with backoff.
+        circuit_breakers.check(urlparse(url).netloc, self.circuit_breaker_cooldown)
+
+        if key:
+            # Share the download with other processes making the same request at the same time, if coordinated.
+            response, shared = host_coordinator.coalesce(
+                json.dumps([prepared.url, headers], sort_keys=True),
+                lambda: self._fetch(method, url, **kwargs),
+                build_response,
+            )
+            if shared:
+                self._count("shared")
+        else:
+            response = self._fetch(method, url, **kwargs)
+
+        if HTTP_FIXTURES == "record":
+            self.http_archive.record(method, url, response, **kwargs)
+        if key:
+            if response.status_code == 200:
+                self.memo.set(key, response, len(response.content))
+            self._record_source("GET", prepared.url, kwargs.get("headers"), response.content)
+        else:
+            # The request can't be repeated to check whether its source changed.
+            self.sources_complete = False
+        return response
+
+    def _fetch(self, method, url, **kwargs):
+        if method.upper() == "GET" and self.revalidate and not kwargs.get("stream"):
+            return self._revalidating_request(method, url, **kwargs)
+        response = super().request(method, url, **kwargs)
+        if not kwargs.get("stream"):
+            self._count_bytes(response)
+        return response
+
+    def _record_source(self, method, url, headers, content):
+        with self._stats_lock:
+            self.sources[(method, url, json.dumps(headers or {}, sort_keys=True))] = hashlib.sha1(content).hexdigest()
+
+    def ftp_get(self, url):
+        """
+        Returns the content of a file on an FTP server.
+        """
+        if HTTP_FIXTURES == "replay":
+            return self.http_archive.get(self.http_archive.key("RETR", url), "RETR {}".format(url))[1]
+
+        result = urlparse(url)
+        data = BytesIO()
+        ftp = FTP(result.hostname)
+        ftp.login(result.username, result.password)
+        ftp.retrbinary("RETR {}".format(result.path), data.write)
+        ftp.quit()
+        content = data.getvalue()
+
+        if HTTP_FIXTURES == "record":
+            self.http_archive.set(self.http_archive.key("RETR", url), {"method": "RETR", "url": url}, content)
+        self._record_source("RETR", url, None, content)
+        return content
+
+    def _request_headers(self, headers):
+        """
+        Returns the headers that a request with the headers sends, including the
+        session's, e.g. its user agent, with lowercase names.
+        """
+        merged = requests.sessions.merge_setting(
+            headers, self.headers, dict_class=requests.structures.CaseInsensitiveDict
+        )
+        return {name.lower(): value for name, value in merged.items()}
+
+    def _revalidating_request(self, method, url, **kwargs):
+        prepared = requests.PreparedRequest()
+        prepared.prepare_url(url, kwargs.get("params"))
+        key = prepared.url
+        # Some hosts respond differently by user agent, e.g. with a page that blocks bots.
+        request_headers = self._request_headers(kwargs.get("headers"))
+
+        metadata, body = http_cache.get(key)
+        if (
+            metadata
+            and HTTP_CACHE_SINCE
+            and metadata.get("stored_at", 0) >= HTTP_CACHE_SINCE
+            and metadata.get("request_headers") == request_headers
+        ):
+            self._count("fresh hits")
+            return HTTPCache.response(metadata, body)
+        if metadata:
+            kwargs["headers"] = dict(HTTPCache.conditional_headers(metadata), **(kwargs.get("headers") or {}))
+
+        response = super().request(method, url, **kwargs)
+        self._count_bytes(response)
+
+        if response.status_code == 304 and metadata:
+            self._count("hits")
+            http_cache.touch(key)
+            return HTTPCache.response(metadata, body)
+        self._count("misses")
+        if response.status_code == 200 and not getattr(response, "fromcache", False):
+            # The response is good even if it can't be cached.
+            try:
+                http_cache.set(key, response, request_headers)
+            except OSError as e:
+                self.warning("Couldn't cache {}: {}".format(url, e))
+        return response
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.http_cache_stats[key] += 1
+
+    def _count_bytes(self, response):
+        if not getattr(response, "fromcache", False):
+            with self._stats_lock:
+                self.bytes_fetched += len(response.content)
+
+    def _count_memo(self, key):
+        with self._stats_lock:
+            self.memo_stats[key] += 1
+
+    def do_scrape(self, **kwargs):
+        snapshot = ScrapeSnapshot(os.path.join(self.datadir, "_snapshots", self.__class__.__name__))
+        signature = self.code_signature(kwargs)
+        self.signature = signature
+        try:
+            record = None
+            if self.reuse_unchanged_output and not FORCE_SCRAPE and not HTTP_FIXTURES:
+                record = self._reuse_unchanged_output(snapshot, signature)
+            if record is None:
+                self.sources.clear()
+                self.sources_complete = True
+                record = super().do_scrape(**kwargs)
+                if self.reuse_unchanged_output and self.sources_complete:
+                    snapshot.save(self.datadir, signature, list(self.sources.items()), self.output_names, record)
+        except Exception as e:
+            # Report the URL that failed, or else the last URL requested.
+            if not getattr(e, "url", None):
+                e.url = getattr(getattr(e, "request", None), "url", None) or getattr(self, "last_url", None)
+            raise
+        finally:
+            if HTTP_FIXTURES == "record":
+                self.http_archive.save()
+            charset_registry.save()
+        record["http_cache"] = dict(self.http_cache_stats)
+        record["memo"] = dict(self.memo_stats)
+        record["bytes_fetched"] = self.bytes_fetched
+        # A digest of the sources, to detect whether they changed since another run.
+        if self.sources_complete:
+            sources = json.dumps(sorted(self.sources.items()))
+            record["sources_digest"] = hashlib.sha1(sources.encode("utf-8")).hexdigest()
+        self.info(
+            "HTTP cache: {} hits, {} misses".format(self.http_cache_stats["hits"], self.http_cache_stats["misses"])
+        )
+        if self.http_cache_stats["fresh hits"]:
+            self.info("{} responses reused without requests".format(self.http_cache_stats["fresh hits"]))
+        if self.http_cache_stats["shared"]:
+            self.info("{} responses shared by other processes".format(self.http_cache_stats["shared"]))
+        self.info(
+            "Memo: {} page hits, {} page misses, {} response hits, {} response misses".format(
+                self.memo_stats["page hits"],
+                self.memo_stats["page misses"],
+                self.memo_stats["response hits"],
+                self.memo_stats["response misses"],
+            )
+        )
+        if self.memo_stats["extraction hits"] or self.memo_stats["extraction misses"]:
+            self.info(
+                "Extractions: {} hits, {} misses".format(
+                    self.memo_stats["extraction hits"], self.memo_stats["extraction misses"]
+                )
+            )
+        return record
+
+    def scrape_units(self, units, scrape_unit):
+        """
+        Yields the objects that `scrape_unit(unit)` yields, for each `(key,
+        unit)` pair, in which `key` identifies the unit across runs, e.g. its URL.
+
+        Each unit's objects are checkpointed, so that, if the crawl doesn't
+        finish, the next run resumes it, reusing the completed units' objects.
+        A unit that fails doesn't stop the crawl: its error is logged and
+        recorded in `errors.json`, and an exception is raised once all other
+        units are done. The next run then retries only the failed units.
+        """
+        checkpoint = UnitCheckpoint(os.path.join(self.datadir, "_checkpoints", self.__class__.__name__))
+        signature = getattr(self, "signature", None)
+        attributes = checkpoint.load(signature, self.checkpoint_max_age)
+        if attributes:
+            for name, value in attributes.items():
+                setattr(self, name, value)
+
+        units = list(units)
+        errors = []
+        occurrences = Counter()
+        for key, unit in units:
+            # Distinguish units with the same key by their order.
+            occurrences[key] += 1
+            if occurrences[key] > 1:
+                key = "{} #{}".format(key, occurrences[key])
+
+            objects = checkpoint.get(key)
+            if objects is not None:
+                self._count_memo("checkpoint hits")
+                # The completed units' sources weren't requested in this run.
+                self.sources_complete = False
+                yield from objects
+                continue
+
+            before = {name: copy.deepcopy(getattr(self, name)) for name in self.checkpoint_attributes}
+            self.last_url = None
+            try:
+                objects = list(scrape_unit(unit))
+            except Exception as e:
+                # Undo the unit's changes to the state, so that it can be retried.
+                for name, value in before.items():
+                    setattr(self, name, value)
+                self.logger.exception("Failed unit {}".format(key))
+                errors.append({"unit": key, "exception": type(e).__name__, "message": str(e), "url": self.last_url})
+                continue
+
+            checkpoint.set(key, objects, signature, {name: getattr(self, name) for name in self.checkpoint_attributes})
+            yield from objects
+
+        if errors:
+            checkpoint.write_errors(errors)
+            raise Exception(
+                "{} of {} units failed (see {}). Run the scraper again to retry them.".format(
+                    len(errors), len(units), checkpoint.errors_path
+                )
+            )
+        checkpoint.clear()
+
+    def code_signature(self, kwargs):
+        """
+        Returns a hash of the code and data that determine the scraper's output,
+        other than its sources.
+        """
+        paths = [
+            inspect.getsourcefile(self.__class__),
+            inspect.getsourcefile(self.jurisdiction.__class__),
+            __file__,
+            patch.__file__,
+            division_index.csv_path,
+        ]
+        digest = hashlib.sha1(json.dumps(kwargs, sort_keys=True).encode("utf-8"))
+        for path in paths:
+            digest.update(file_sha1(path).encode("ascii"))
+        return digest.hexdigest()
+
+    def _reuse_unchanged_output(self, snapshot, signature):
+        """
+        Restores the output of the last run and returns its record, if its
+        sources and code are unchanged.
+        """
+        manifest = snapshot.load()
+        if not manifest or manifest["signature"] != signature:
+            return None
+        # Sources are requested in the order in which the last run requested them,
+        # and conditionally, if they have validators.
+        for (method, url, headers), digest in manifest["sources"]:
+            try:
+                if method == "RETR":
+                    content = self.ftp_get(url)
+                else:
+                    content = self.get(url, headers=json.loads(headers)).content
+            except Exception as e:
+                self.info("Scraping, as {} failed: {}".format(url, e))
+                return None
+            if hashlib.sha1(content).hexdigest() != digest:
+                self.info("Scraping, as {} changed".format(url))
+                return None
+
+        start = utcnow()
+        if not snapshot.restore(self.datadir):
+            return None
+        self.info(
+            "Reusing the output of the last run, as its {} sources are unchanged".format(len(manifest["sources"]))
+        )
+        return {
+            "objects": defaultdict(int, manifest["objects"]),
+            "start": start,
+            "end": utcnow(),
+            "skipped": 0,
+            "unchanged": True,
+            "imported": manifest["imported"],
+        }
+
+    def probe(self, **kwargs):
+        """
+        Returns why the scraper must run, or `None` if the output of its last
+        run was imported and neither its code nor its sources changed since.
+
+        Each source costs a conditional GET, whose body is hashed if the server
+        has no validators. If the server has no validators but sent the length
+        of the cached source, a HEAD request is sent first, which skips the GET
+        only if the length changed: if it didn't, the source costs both.
+        """
+        manifest = ScrapeSnapshot(os.path.join(self.datadir, "_snapshots", self.__class__.__name__)).load()
+        if not manifest:
+            return "no output to reuse"
+        if not manifest["imported"]:
+            return "output not imported"
+        if manifest["signature"] != self.code_signature(kwargs):
+            return "code changed"
+        for (method, url, headers), digest in manifest["sources"]:
+            if method != "GET":
+                return "{} {} can't be probed".format(method, url)
+            try:
+                if self._source_changed(url, json.loads(headers), digest):
+                    return "{} changed".format(url)
+            except Exception as e:
+                return "{} failed: {}".format(url, e)
+        return None
+
+    def probe_entry(self, url, **kwargs):
+        """
+        Returns why the scraper must run, or `None` if neither its code nor its
+        entry page `url`, e.g. its council page, changed since its last run.
+        The other sources aren't probed, so that the probe costs one request.
+        """
+        manifest = ScrapeSnapshot(os.path.join(self.datadir, "_snapshots", self.__class__.__name__)).load()
+        if not manifest:
+            return "no output to compare"
+        if manifest["signature"] != self.code_signature(kwargs):
+            return "code changed"
+        prepared = requests.PreparedRequest()
+        prepared.prepare_url(url, None)
+        for (method, source_url, headers), digest in manifest["sources"]:
+            if method == "GET" and source_url == prepared.url:
+                if self._source_changed(source_url, json.loads(headers), digest):
+                    return "{} changed".format(url)
+                return None
+        return "{} wasn't requested".format(url)
+
+    def _source_changed(self, url, headers, digest):
+        metadata, body = http_cache.get(url)
+        cached = body is not None and hashlib.sha1(body).hexdigest() == digest
+        # A HEAD request can only tell that a source changed, by its length.
+        if cached and not HTTPCache.conditional_headers(metadata) and metadata.get("length"):
+            response = self.head(url, headers=headers, allow_redirects=True, verify=SSL_VERIFY)
+            length = response.headers.get("content-length")
+            # A compressed response's Content-Length isn't the length of the body.
+            if response.status_code == 200 and length and not response.headers.get("content-encoding"):
+                if int(length) != len(body):
+                    return True
+        # The GET reuses the cached body on a 304.
+        return hashlib.sha1(self.get(url, headers=headers).content).hexdigest() != digest
+
     def get(self, *args, **kwargs):
         return super().get(*args, verify=SSL_VERIFY, **kwargs)
 
     def post(self, *args, **kwargs):
         return super().post(*args, verify=SSL_VERIFY, **kwargs)
 
-    def lxmlize(self, url, encoding=None, user_agent=requests.utils.default_user_agent(), cookies=None, xml=False):
-        self.user_agent = user_agent
+    def charset(self, response):
+        """
+        Returns the response's charset, from its byte order mark, Content-Type
+        header, or `<meta charset>` or XML declaration. Otherwise, returns the
+        charset guessed for the URL on a previous run, or guesses it.
+        """
+        charset = declared_charset(response.content, response.headers.get("content-type", ""))
+        if not charset:
+            charset = charset_registry.get(response.url)
+            if not charset:
+                charset = guess_charset(response.content)
+                charset_registry.set(response.url, charset)
+        return charset
+
+    def lxmlize(
+        self, url, encoding=None, user_agent=requests.utils.default_user_agent(), cookies=None, xml=False, scope=None
+    ):
+        """
+        If `scope` is an XPath step like `//div[@id="main-content"]`, parses only
+        until the end of the first matching element and returns a copy of that
+        element, detached from its ancestors: the element is the root of its
+        document, so `..` finds nothing and `//` searches only the element.
+        The predicate can test only the element's tag and attributes.
+
+        If the same page is requested again in this run, returns a copy of the
+        page parsed earlier.
+        """
+        if cookies:
+            return self._lxmlize(url, encoding, user_agent, cookies, xml, scope)[0]
+
+        key = ("page", url, encoding, user_agent, xml, scope)
+        memo = self.memo.get(key)
+        if memo is None:
+            self._count_memo("page misses")
+            page, size = self._lxmlize(url, encoding, user_agent, cookies, xml, scope)
+            # A parsed page takes about four times the size of its body.
+            self.memo.set(key, page, 4 * size)
+        else:
+            self._count_memo("page hits")
+            page = memo
+        # Copy the page, in case the caller modifies it.
+        return copy.deepcopy(page)
 
-        response = self.get(url, cookies=cookies)
-        if encoding:
-            response.encoding = encoding
+    def _lxmlize(self, url, encoding, user_agent, cookies, xml, scope):
+        """
+        Returns the page and the size of the response body.
+        """
+        # Send the user agent with the request, instead of setting the session's, which other threads share.
+        response = self.get(url, cookies=cookies, headers={"User-Agent": user_agent})
+        charset = encoding or self.charset(response)
+
+        if scope and not xml:
+            page, refresh = parse_html_scope(response.content, scope, encoding=charset)
+            if refresh:
+                _, url = refresh.split("=", 1)
+                return self.lxmlize(url, encoding, scope=scope), len(response.content)
+            if page is None:
+                raise Exception("No element matching {} in {}".format(scope, url))
+            page.make_links_absolute(url)
+            return page, len(response.content)
 
+        # Parse the bytes, rather than decoding them first.
         try:
-            text = response.text
             if xml:
-                text = text.replace('<?xml version="1.0" encoding="utf-8"?>', "")  # XXX ca_bc
-                page = etree.fromstring(text)
+                page = etree.fromstring(response.content, parser=etree.XMLParser(encoding=charset))
             else:
-                page = lxml.html.fromstring(text)
+                page = lxml.html.fromstring(response.content, parser=lxml.html.HTMLParser(encoding=charset))
         except etree.ParserError:
             raise etree.ParserError("Document is empty {}".format(url))
 
-        meta = page.xpath('//meta[@http-equiv="refresh"]')
+        meta = self.xpath(page, '//meta[@http-equiv="refresh"]')
         if meta:
             _, url = meta[0].attrib["content"].split("=", 1)
-            return self.lxmlize(url, encoding)
+            return self.lxmlize(url, encoding), len(response.content)
         elif xml:
-            return page
+            return page, len(response.content)
         else:
             page.make_links_absolute(url)
-            return page
+            return page, len(response.content)
+
+    def lxmlize_many(self, urls, max_workers=8, per_host=None, **kwargs):
+        """
+        Fetches and parses pages concurrently, yielding `(url, page)` tuples in
+        the order of `urls`. Keyword arguments are passed to `lxmlize`.
+
+        At most `max_workers` requests are in flight. The number of requests to
+        the same host adapts to the host (see `host_concurrency`), up to
+        `per_host`, if set.
+        """
+        urls = list(urls)
+        semaphores = {}
+        if per_host:
+            hosts = {urlparse(url).netloc for url in urls}
+            semaphores = {host: threading.BoundedSemaphore(per_host) for host in hosts}
+
+        def fetch(url):
+            semaphore = semaphores.get(urlparse(url).netloc)
+            if semaphore:
+                with semaphore:
+                    return self.lxmlize(url, **kwargs)
+            return self.lxmlize(url, **kwargs)
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(fetch, url) for url in urls]
+            for url, future in zip(urls, futures):
+                yield url, future.result()
 
     def csv_reader(self, url, delimiter=",", header=False, encoding=None, skip_rows=0, data=None, **kwargs):
         if not data:
             result = urlparse(url)
             if result.scheme == "ftp":
-                data = StringIO()
-                ftp = FTP(result.hostname)
-                ftp.login(result.username, result.password)
-                ftp.retrbinary("RETR {}".format(result.path), lambda block: data.write(block.decode("utf-8")))
-                ftp.quit()
-                data.seek(0)
+                data = StringIO(self.ftp_get(url).decode("utf-8"))
             else:
                 response = self.get(url, **kwargs)
-                if encoding:
-                    response.encoding = encoding
-                text = response.text.strip()
-                if text.startswith("\ufeff"):  # BOM
-                    text = text[1:]
-                data = StringIO(text)
+                data = StringIO(decode(response.content, encoding or self.charset(response)).strip())
         if skip_rows:
             for _ in range(skip_rows):
                 data.readline()
@@ -361,18 +1623,10 @@ class CSVScraper(CanadianScraper):
             table.to_csv(data)
             data.seek(0)
         elif extension == ".zip":
-            basename = os.path.basename(self.csv_url)
             if not self.encoding:
                 self.encoding = "utf-8"
-            try:
-                response = requests.get(self.csv_url, stream=True)
-                with open(basename, "wb") as f:
-                    for chunk in response.iter_content():
-                        f.write(chunk)
-                with ZipFile(basename).open(self.filename, "r") as fp:
-                    data = StringIO(fp.read().decode(self.encoding))
-            finally:
-                os.unlink(basename)
+            with ZipFile(BytesIO(self.get(self.csv_url).content)).open(self.filename, "r") as fp:
+                data = StringIO(fp.read().decode(self.encoding))
         else:
             data = None
 
@@ -486,12 +1740,20 @@ class CSVScraper(CanadianScraper):
                 p.add_contact("email", row["email"].strip().split("\n")[-1])  # ca_qc_montreal
             if lines:
                 p.add_contact("address", "\n".join(lines), "legislature")
+            # Normalize the row's numbers together, so that a number without an area code can take the others'.
+            phone, fax, cell = self.telephone_number_normalizer.normalize_many(
+                [
+                    (row.get("phone") or "").split(";", 1)[0],  # ca_qc_montreal, ca_on_huron
+                    row.get("fax") or "",
+                    row.get("cell") or "",
+                ]
+            )
             if row.get("phone"):
-                p.add_contact("voice", row["phone"].split(";", 1)[0], "legislature")  # ca_qc_montreal, ca_on_huron
+                p.add_contact("voice", phone, "legislature")
             if row.get("fax"):
-                p.add_contact("fax", row["fax"], "legislature")
+                p.add_contact("fax", fax, "legislature")
             if row.get("cell"):
-                p.add_contact("cell", row["cell"], "legislature")
+                p.add_contact("cell", cell, "legislature")
             if row.get("birth date"):
                 p.birth_date = row["birth date"]
 
@@ -549,10 +1811,10 @@ class CanadianJurisdiction(Jurisdiction):
     def get_organizations(self):
         organization = Organization(self.name, classification=self.classification)
 
-        leader_role = styles_of_address[self.division_id]["Leader"]
-        member_role = self.member_role or styles_of_address[self.division_id]["Member"]
+        leader_role = styles_of_address()[self.division_id]["Leader"]
+        member_role = self.member_role or styles_of_address()[self.division_id]["Member"]
 
-        parent = Division.get(self.division_id)
+        parent = get_division(self.division_id)
         # Don't yield posts for premiers.
         if parent._type not in ("province", "territory"):
             # Yield posts to allow ca_on_toronto to make changes.
@@ -659,22 +1921,7 @@ class CanadianPerson(Person):
         """
         @see http://www.btb.termiumplus.gc.ca/tpv2guides/guides/favart/index-eng.html?lang=eng&lettr=indx_titls&page=9N6fM9QmOwCE.html
         """
-        splits = re.split(r"(?:\b \(|/|x|ext[.:]?|p\.|poste)[\s-]?(?=\b|\d)", s, flags=re.IGNORECASE)
-        digits = re.sub(r"\D", "", splits[0])
-
-        if len(digits) == 7 and area_code:
-            digits = "1" + str(area_code) + digits
-        elif len(digits) == 10:
-            digits = "1" + digits
-
-        if len(digits) == 11 and digits[0] == "1" and len(splits) <= 2:
-            digits = re.sub(r"\A(\d)(\d{3})(\d{3})(\d{4})\Z", r"\1 \2 \3-\4", digits)
-            if len(splits) == 2:
-                return "{} x{}".format(digits, splits[1].rstrip(")"))
-            else:
-                return digits
-        else:
-            return s
+        return clean_telephone_number(s, area_code)
 
     def clean_address(self, s):
         """
@@ -682,24 +1929,10 @@ class CanadianPerson(Person):
         formats the last line of the address.
         """
         # The letter "O" instead of the numeral "0" is a common mistake.
-        s = re.sub(
-            r"\b[A-Z][O0-9][A-Z]\s?[O0-9][A-Z][O0-9]\b", lambda x: x.group(0).replace("O", "0"), clean_string(s)
-        )
-        for k, v in province_or_territory_abbreviations().items():
-            # Replace a province/territory name with its abbreviation.
-            s = re.sub(
-                r"[,\n ]+"
-                r"\(?" + k + r"\)?"
-                r"(?=(?:[,\n ]+Canada)?(?:[,\n ]+[A-Z][0-9][A-Z]\s?[0-9][A-Z][0-9])?\Z)",
-                " " + v,
-                s,
-            )
-        # Add spaces between province/territory abbreviation, FSA and LDU and remove "Canada".
-        return re.sub(
-            r"[,\n ]+" r"([A-Z]{2})" r"(?:[,\n ]+Canada)?" r"[,\n ]+([A-Z][0-9][A-Z])\s?([0-9][A-Z][0-9])" r"\Z",
-            r" \1  \2 \3",
-            s,
-        )
+        s = postal_code_typo_re.sub(lambda x: x.group(0).replace("O", "0"), clean_string(s))
+        # Replace a province/territory name with its abbreviation, and, if there is a postal code, add spaces between
+        # the province/territory abbreviation, FSA and LDU and remove "Canada".
+        return address_tail_re().sub(format_address_tail, s)
 
 
 whitespace_re = re.compile(r"\s+", flags=re.U)
@@ -707,6 +1940,69 @@ whitespace_and_newline_re = re.compile(r"[^\S\n]+", flags=re.U)
 honorific_prefix_re = re.compile(r"\A(?:Councillor|Dr|Hon|M|Mayor|Mme|Mr|Mrs|Ms|Miss)\.? ")
 honorific_suffix_re = re.compile(r", (?:Ph\.D, Q\.C\.)\Z")
 province_or_territory_abbreviation_memo = {}
+# The charsets of byte order marks, named so that both Python and libxml2 know them.
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "UTF-16LE"),
+    (codecs.BOM_UTF16_BE, "UTF-16BE"),
+)
+content_type_charset_re = re.compile(r"charset=[\"']?([\w.:-]+)", flags=re.IGNORECASE)
+declared_charset_re = re.compile(
+    rb"""(?:<meta[^>]+charset|<\?xml[^>]+encoding)=["']?([\w.:-]+)""", flags=re.IGNORECASE
+)
+address_tail_re_memo = []
+file_sha1_memo = {}
+xpath_memo = {}
+# The directories of cached extractions pruned by this process.
+extraction_directories_pruned = set()
+non_digit_re = re.compile(r"\D")
+telephone_number_extension_re = re.compile(r"(?:\b \(|/|x|ext[.:]?|p\.|poste)[\s-]?(?=\b|\d)", flags=re.IGNORECASE)
+# Matches at every position at which a telephone number starts, including overlapping numbers, so that a single scan
+# finds the same number as a search for a specific area code would.
+telephone_number_candidate_re = re.compile(
+    r"(?<!\d)(?=(?P<number>\(?(?P<area_code>\d{3})\)?\D?\d{3}\D?\d{4}(?:\s*(?:/|x|ext[.:]?|poste)[\s-]?\d+)?)(?!\d))"
+)
+# @see https://www.cnac.ca/area_code_maps/canadian_area_codes.htm
+area_codes_by_province_or_territory = {
+    "AB": (403, 780, 587, 825, 368),
+    "BC": (604, 250, 778, 236, 672, 257),
+    "MB": (204, 431, 584),
+    "NB": (506, 428),
+    "NL": (709, 879),
+    "NS": (902, 782),
+    "NT": (867,),
+    "NU": (867,),
+    "ON": (416, 519, 613, 705, 807, 905, 289, 647, 226, 343, 249, 365, 437, 548, 683, 742, 753, 382, 942),
+    "PE": (902, 782),
+    "QC": (418, 514, 819, 450, 581, 438, 579, 873, 367, 354, 468, 263),
+    "SK": (306, 639, 474),
+    "YT": (867,),
+}
+postal_code_typo_re = re.compile(r"\b[A-Z][O0-9][A-Z]\s?[O0-9][A-Z][O0-9]\b")
+# @see https://www.canadapost-postescanada.ca/cpc/en/support/kb/addressing/postal-codes/postal-code-structure
+fsa_provinces_and_territories = {
+    "A": ("NL",),
+    "B": ("NS",),
+    "C": ("PE",),
+    "E": ("NB",),
+    "G": ("QC",),
+    "H": ("QC",),
+    "J": ("QC",),
+    "K": ("ON",),
+    "L": ("ON",),
+    "M": ("ON",),
+    "N": ("ON",),
+    "P": ("ON",),
+    "R": ("MB",),
+    "S": ("SK",),
+    "T": ("AB",),
+    "V": ("BC",),
+    "X": ("NT", "NU"),
+    "Y": ("YT",),
+}
+division_name_punctuation_re = re.compile(r"[^a-z0-9]+")
+division_name_abbreviations = {"st": "saint", "ste": "sainte", "mt": "mount"}
+division_name_stopwords = {"d", "de", "des", "du", "l", "la", "le", "les", "of", "the"}
 
 table = {
     ord("​"): " ",  # zero-width space
@@ -715,17 +2011,412 @@ table = {
 }
 
 
+def memoize_extraction(method):
+    """
+    Caches the results of a scraper method on disk, by the URL and content of
+    its first argument: a URL or a page. Use it on methods that parse a detail
+    page, so that an unchanged page isn't parsed again on the next run.
+
+    Changes to the method's module or to `utils.py` invalidate the cache. The
+    other arguments must have stable representations, as they are part of the
+    cache key. Exceptions aren't cached.
+    """
+    path = os.path.join(settings.CACHE_DIR, "extractions", method.__module__, method.__qualname__)
+
+    @wraps(method)
+    def wrapper(self, url_or_page, *args, **kwargs):
+        code = hashlib.sha1(
+            (file_sha1(inspect.getsourcefile(method)) + file_sha1(__file__)).encode("ascii")
+        ).hexdigest()
+        directory = os.path.join(path, code)
+        if directory not in extraction_directories_pruned:
+            extraction_directories_pruned.add(directory)
+            prune_extractions(path, code)
+
+        if isinstance(url_or_page, str):
+            url = url_or_page
+            # Request the URL as `lxmlize` does, so that the method reuses the response.
+            content = self.get(url, headers={"User-Agent": requests.utils.default_user_agent()}).content
+        else:
+            url = url_or_page.base_url
+            content = etree.tostring(url_or_page)
+
+        # Links are made absolute relative to the URL, so the same content at another URL can give another result.
+        digest = hashlib.sha1(content)
+        for value in (repr(url), repr((args, kwargs))):
+            digest.update(value.encode("utf-8"))
+        filename = os.path.join(directory, "{}.pickle".format(digest.hexdigest()))
+
+        try:
+            with open(filename, "rb") as f:
+                result = pickle.load(f)
+            # Record the use, so that the entry isn't pruned.
+            os.utime(filename)
+            self._count_memo("extraction hits")
+            return result
+        except (OSError, EOFError, pickle.UnpicklingError):
+            pass
+
+        self._count_memo("extraction misses")
+        result = method(self, url_or_page, *args, **kwargs)
+        os.makedirs(directory, exist_ok=True)
+        tmp = "{}.{}.{}".format(filename, os.getpid(), threading.get_ident())
+        with open(tmp, "wb") as f:
+            pickle.dump(result, f)
+        os.replace(tmp, filename)
+        return result
+
+    return wrapper
+
+
+def prune_extractions(path, code, max_age=EXTRACTIONS_MAX_AGE):
+    """
+    Deletes a method's cached extractions for other versions of the code, and
+    those unused for `max_age` seconds.
+    """
+    if not os.path.isdir(path):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(path):
+        directory = os.path.join(path, name)
+        if name != code:
+            if os.path.isdir(directory):
+                shutil.rmtree(directory, ignore_errors=True)
+            else:
+                os.remove(directory)
+            continue
+        for filename in os.listdir(directory):
+            try:
+                if os.path.getmtime(os.path.join(directory, filename)) < cutoff:
+                    os.remove(os.path.join(directory, filename))
+            except OSError:
+                pass
+
+
 def province_or_territory_abbreviations():
     if not province_or_territory_abbreviation_memo:
         province_or_territory_abbreviation_memo["PEI"] = "PE"
-        for division in Division.all("ca"):
-            if division._type in ("province", "territory"):
-                abbreviation = division.id.rsplit(":", 1)[1].upper()
-                province_or_territory_abbreviation_memo[division.name] = abbreviation
-                province_or_territory_abbreviation_memo[division.attrs["name_fr"]] = abbreviation
+        for division in division_index.all("province", "territory"):
+            abbreviation = division.id.rsplit(":", 1)[1].upper()
+            province_or_territory_abbreviation_memo[division.name] = abbreviation
+            province_or_territory_abbreviation_memo[division.attrs["name_fr"]] = abbreviation
     return province_or_territory_abbreviation_memo
 
 
+def compiled_xpath(expression):
+    """
+    Returns the compiled XPath expression, compiling it only once.
+    """
+    try:
+        return xpath_memo[expression]
+    except KeyError:
+        # lxml serializes concurrent evaluations of the same compiled expression.
+        compiled = xpath_memo[expression] = etree.XPath(expression)
+        return compiled
+
+
+def parse_retry_after(value):
+    """
+    Returns the number of seconds to wait, from a `Retry-After` header value.
+    """
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, mktime_tz(parsedate_tz(value)) - time.time())
+        except TypeError:
+            return None
+
+
+def known_charset(label):
+    """
+    Returns the charset label, if Python knows its encoding.
+    """
+    try:
+        codecs.lookup(label)
+        return label
+    except LookupError:
+        return None
+
+
+def declared_charset(content, content_type=""):
+    """
+    Returns the charset declared by the byte order mark, the Content-Type
+    header, or a `<meta>` tag or XML declaration near the start of the bytes.
+    """
+    for bom, charset in BYTE_ORDER_MARKS:
+        if content.startswith(bom):
+            return charset
+    match = content_type_charset_re.search(content_type)
+    if match and known_charset(match.group(1)):
+        return match.group(1)
+    match = declared_charset_re.search(content, 0, 4096)
+    if match and known_charset(match.group(1).decode("ascii")):
+        return match.group(1).decode("ascii")
+
+
+def guess_charset(content, limit=65536):
+    """
+    Returns "utf-8" if the first bytes are valid UTF-8, and "windows-1252" otherwise.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    try:
+        # A multi-byte character may be cut off at the limit.
+        decoder.decode(content[:limit], final=len(content) <= limit)
+        return "utf-8"
+    except UnicodeDecodeError:
+        return "windows-1252"
+
+
+def decode(content, charset):
+    """
+    Decodes the bytes, skipping any byte order mark without copying the bytes.
+    """
+    view = memoryview(content)
+    for bom, _ in BYTE_ORDER_MARKS:
+        if content.startswith(bom):
+            view = view[len(bom) :]
+            break
+    return str(view, charset, "replace")
+
+
+def parse_html_scope(content, scope, encoding=None, chunk_size=262144):
+    """
+    Parses the HTML bytes incrementally, until the end of the first element
+    matching the XPath step `scope`, discarding other elements as they end.
+
+    Returns the element, which is still attached to its ancestors (but not to
+    their preceding siblings), and the content of any `<meta http-equiv="refresh">`
+    before it. `lxmlize` returns a detached copy of the element.
+    """
+    if scope.startswith("//"):
+        scope = scope[2:]
+    matches = compiled_xpath("self::{}".format(scope))
+    # Report only elements with the scope's tag, to avoid a Python call per element.
+    tag = re.match(r"[\w-]+", scope)
+    tags = ["meta", tag.group(0)] if tag else None
+
+    parser = etree.HTMLPullParser(events=("start", "end"), tag=tags, encoding=encoding)
+    parser.set_element_class_lookup(lxml.html.HtmlElementClassLookup())
+
+    content = memoryview(content)
+    match = None
+    refresh = None
+    for offset in range(0, len(content), chunk_size):
+        parser.feed(bytes(content[offset : offset + chunk_size]))
+        for event, element in parser.read_events():
+            if match is None:
+                if event == "start":
+                    if matches(element):
+                        match = element
+                    elif element.tag == "meta" and element.get("http-equiv", "").lower() == "refresh":
+                        refresh = element.get("content")
+                else:
+                    # The element is outside the scope, and so are its preceding siblings. Free them.
+                    element.clear(keep_tail=True)
+                    while element.getprevious() is not None:
+                        del element.getparent()[0]
+            elif event == "end" and element is match:
+                return match, refresh
+    try:
+        parser.close()
+    except etree.XMLSyntaxError:  # empty document
+        pass
+    return match, refresh
+
+
+@lru_cache(maxsize=4096)
+def clean_telephone_number(s, area_code=None):
+    """
+    Formats a telephone number like "1 613 555-0100 x123", or returns it
+    unchanged if it can't be parsed. Results are cached, as many people share
+    a number, e.g. a city hall's.
+    """
+    splits = telephone_number_extension_re.split(s)
+    digits = non_digit_re.sub("", splits[0])
+
+    if len(digits) == 7 and area_code:
+        digits = "1" + str(area_code) + digits
+    elif len(digits) == 10:
+        digits = "1" + digits
+
+    if len(digits) == 11 and digits[0] == "1" and len(splits) <= 2:
+        digits = "{} {} {}-{}".format(digits[0], digits[1:4], digits[4:7], digits[7:])
+        if len(splits) == 2:
+            return "{} x{}".format(digits, splits[1].rstrip(")"))
+        else:
+            return digits
+    else:
+        return s
+
+
+def province_or_territory_abbreviation_of(division_id):
+    """
+    Returns the abbreviation of the province or territory containing the division, if any.
+    """
+    match = re.search(r"/(?:province|territory):(\w\w)\b", division_id)
+    if match:
+        return match.group(1).upper()
+    match = re.search(r"/(?:cd|csd):(\d\d)", division_id)
+    if match:
+        for division in division_index.by_sgc_prefix(match.group(1)):
+            if division._type in ("province", "territory"):
+                return division.id.rsplit(":", 1)[1].upper()
+
+
+class TelephoneNumberNormalizer(object):
+    """
+    Formats telephone numbers in a province or territory.
+
+    If a number has seven digits and no area code is given, the area code is
+    inferred: from the province or territory, if it has only one area code;
+    otherwise, in `normalize_many`, from the other numbers in the batch, if
+    they have a single area code of the province or territory.
+    """
+
+    def __init__(self, province_or_territory=None):
+        self.area_codes = area_codes_by_province_or_territory.get(province_or_territory, ())
+
+    def normalize(self, s, area_code=None):
+        if area_code is None and len(self.area_codes) == 1:
+            area_code = self.area_codes[0]
+        return clean_telephone_number(clean_string(s), area_code)
+
+    def normalize_many(self, values, area_code=None):
+        values = [clean_string(value) for value in values]
+        if area_code is None:
+            area_codes = set()
+            for value in values:
+                digits = non_digit_re.sub("", telephone_number_extension_re.split(value)[0])
+                if len(digits) == 10:
+                    area_codes.add(int(digits[:3]))
+                elif len(digits) == 11 and digits[0] == "1":
+                    area_codes.add(int(digits[1:4]))
+            if len(area_codes) == 1 and (not self.area_codes or area_codes <= set(self.area_codes)):
+                area_code = area_codes.pop()
+        return [self.normalize(value, area_code) for value in values]
+
+
+def address_tail_re():
+    """
+    Returns a regular expression matching the last line of an address: a
+    province/territory name or abbreviation, optionally followed by "Canada"
+    and a postal code.
+    """
+    if not address_tail_re_memo:
+        names = sorted(province_or_territory_abbreviations(), key=len, reverse=True)
+        address_tail_re_memo.append(
+            re.compile(
+                r"[,\n ]+"
+                r"(?:\(?(?P<name>" + "|".join(re.escape(name) for name in names) + r")\)?|(?P<abbreviation>[A-Z]{2}))"
+                r"(?P<canada>[,\n ]+Canada)?"
+                r"(?:[,\n ]+(?P<fsa>[A-Z][0-9][A-Z])\s?(?P<ldu>[0-9][A-Z][0-9]))?"
+                r"\Z"
+            )
+        )
+    return address_tail_re_memo[0]
+
+
+def format_address_tail(match):
+    name, abbreviation, fsa, ldu = match.group("name", "abbreviation", "fsa", "ldu")
+    if name:
+        abbreviation = province_or_territory_abbreviations()[name]
+    if fsa:
+        if abbreviation not in fsa_provinces_and_territories.get(fsa[0], ()):
+            logger.warning("Postal code {} {} is not in {}".format(fsa, ldu, abbreviation))
+        return " {}  {} {}".format(abbreviation, fsa, ldu)
+    if name:
+        return " {}{}".format(abbreviation, match.group("canada") or "")
+    return match.group(0)
+
+
+def get_division(division_id):
+    """
+    Returns a division from the division index. Use instead of `Division.get`,
+    which parses the whole CSV of divisions.
+    """
+    return division_index.get(division_id)
+
+
+def normalize_division_name(name):
+    """
+    Returns a key for matching a division name to its spelling in another
+    source. Folds case, accents, dashes and punctuation, expands "St" and "Ste"
+    to "Saint" and "Sainte", and removes articles and French prepositions.
+
+    A last word is never removed, so that BC census designations like "D" and
+    "L" (e.g. "Cariboo D", "Cariboo L") still distinguish divisions.
+    """
+    name = unidecode(str(name)).lower()
+    names = division_name_punctuation_re.sub(" ", name).split()
+    words = []
+    for i, word in enumerate(names):
+        word = division_name_abbreviations.get(word, word)
+        if word not in division_name_stopwords or i == len(names) - 1:
+            words.append(word)
+    return " ".join(words)
+
+
+class DivisionNameResolver(object):
+    """
+    Resolves division names to identifiers within a province or territory.
+
+    Exact names are tried first, then normalized names. For unknown names,
+    the error lists the closest normalized names.
+    """
+
+    def __init__(self, province_or_territory, _type="csd", exclude_classifications=()):
+        parent = get_division("ocd-division/country:ca/{}".format(province_or_territory))
+        self.exact = defaultdict(set)
+        self.normalized = defaultdict(set)
+        for division in division_index.by_sgc_prefix(parent.attrs["sgc"], _type):
+            if division.attrs["classification"] in exclude_classifications:
+                continue
+            self.exact[division.name].add(division.id)
+            self.normalized[normalize_division_name(division.name)].add(division.id)
+
+    def resolve(self, name):
+        """
+        Returns the identifier of the division with the name, or `None` if the
+        name is ambiguous. Raises `KeyError` if the name is unknown.
+        """
+        ids = self.exact.get(name) or self.normalized.get(normalize_division_name(name))
+        if not ids:
+            candidates = ", ".join(self.candidates(name))
+            raise KeyError("unknown division name: {} (did you mean: {})".format(name, candidates))
+        if len(ids) > 1:
+            return None
+        return next(iter(ids))
+
+    def resolve_many(self, names):
+        """
+        Returns a dictionary of names to identifiers. See `resolve`.
+        """
+        return {name: self.resolve(name) for name in set(names)}
+
+    def candidates(self, name, n=5):
+        """
+        Returns the division names whose normalized names are closest to the
+        name's, from most to least similar.
+        """
+        keys = difflib.get_close_matches(normalize_division_name(name), self.normalized.keys(), n=n, cutoff=0.6)
+        names = {division_id: division_name for division_name, ids in self.exact.items() for division_id in ids}
+        return [names[division_id] for key in keys for division_id in sorted(self.normalized[key])]
+
+
+division_name_resolver_memo = {}
+
+
+def division_name_resolver(province_or_territory, _type="csd", exclude_classifications=()):
+    """
+    Returns a division name resolver, which is built once per process.
+    """
+    key = (province_or_territory, _type, tuple(sorted(exclude_classifications)))
+    if key not in division_name_resolver_memo:
+        division_name_resolver_memo[key] = DivisionNameResolver(province_or_territory, _type, exclude_classifications)
+    return division_name_resolver_memo[key]
+
+
 def clean_string(s):
     return re.sub(r" *\n *", "\n", whitespace_and_newline_re.sub(" ", str(s).translate(table)).strip())
 
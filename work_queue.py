@@ -0,0 +1,242 @@
+# coding: utf-8
+"""
+A durable queue of jurisdictions in a SQLite database, from which workers on
+any number of nodes lease jobs, so that no node idles while others have work.
+
+A worker leases a job for `lease_seconds`, and renews its lease with heartbeats
+while the job runs. If a worker dies, its lease expires, and the job is
+requeued, up to `max_attempts` times. Each job's timing is kept, to measure
+the fleet's throughput and straggler tail.
+
+The database must be on a disk shared by the nodes, with working file locks.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import statistics
+import time
+
+from runner import Runner
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    batch TEXT,
+    module TEXT,
+    position INTEGER,
+    status TEXT,
+    attempts INTEGER DEFAULT 0,
+    worker TEXT,
+    leased_until REAL,
+    enqueued_at REAL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT,
+    PRIMARY KEY (batch, module)
+);
+CREATE INDEX IF NOT EXISTS jobs_batch_status_position ON jobs (batch, status, position);
+"""
+
+
+class WorkQueue(object):
+    def __init__(self, path, max_attempts=3):
+        self.path = path
+        self.max_attempts = max_attempts
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Let SQLite wait for other nodes' transactions, and manage transactions explicitly.
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.executescript(SCHEMA)
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # Take the write lock at once, so that two workers can't lease the same job.
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield self.connection
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+
+    def enqueue(self, batch, module_names):
+        """
+        Adds the modules to the batch, to be leased in order.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR IGNORE INTO jobs (batch, module, position, status, enqueued_at) "
+                "VALUES (?, ?, ?, 'queued', ?)",
+                [(batch, module_name, position, now) for position, module_name in enumerate(module_names)],
+            )
+
+    def latest_batch(self):
+        row = self.connection.execute("SELECT batch FROM jobs ORDER BY enqueued_at DESC LIMIT 1").fetchone()
+        if row:
+            return row[0]
+
+    def lease(self, batch, worker, lease_seconds):
+        """
+        Leases the batch's next queued job to the worker, and returns its
+        module, or returns `None` if no job is queued.
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            self._requeue_expired(batch, now)
+            row = connection.execute(
+                "SELECT module FROM jobs WHERE batch = ? AND status = 'queued' ORDER BY position LIMIT 1", (batch,)
+            ).fetchone()
+            if row:
+                connection.execute(
+                    "UPDATE jobs SET status = 'leased', attempts = attempts + 1, worker = ?, leased_until = ?, "
+                    "started_at = ? WHERE batch = ? AND module = ?",
+                    (worker, now + lease_seconds, now, batch, row[0]),
+                )
+        if row:
+            return row[0]
+
+    def _requeue_expired(self, batch, now):
+        for module_name, attempts, worker in self.connection.execute(
+            "SELECT module, attempts, worker FROM jobs WHERE batch = ? AND status = 'leased' AND leased_until < ?",
+            (batch, now),
+        ).fetchall():
+            if attempts < self.max_attempts:
+                logger.warning("%s: lease of %s expired, requeuing", module_name, worker)
+                status, result = "queued", None
+            else:
+                logger.error("%s: lease of %s expired after %d attempts", module_name, worker, attempts)
+                status, result = "failed", json.dumps({"status": "lost", "error": "Lease expired"})
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, worker = NULL, leased_until = NULL, finished_at = ?, result = ? "
+                "WHERE batch = ? AND module = ?",
+                (status, now if result else None, result, batch, module_name),
+            )
+
+    def heartbeat(self, batch, module_name, worker, lease_seconds):
+        """
+        Renews the worker's lease of the job. Returns whether the worker still held the lease.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET leased_until = ? WHERE batch = ? AND module = ? AND status = 'leased' AND worker = ?",
+                (time.time() + lease_seconds, batch, module_name, worker),
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, batch, result, worker):
+        """
+        Records the result of a job returned by `Runner.run`. Returns whether
+        the worker still held the lease: if not, e.g. if its lease expired and
+        the job was requeued, the result is ignored.
+        """
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE jobs SET status = ?, leased_until = NULL, finished_at = ?, result = ? "
+                "WHERE batch = ? AND module = ? AND status = 'leased' AND worker = ?",
+                (
+                    "done" if result["status"] == "ok" else "failed",
+                    time.time(),
+                    json.dumps(result, sort_keys=True),
+                    batch,
+                    result["module"],
+                    worker,
+                ),
+            )
+        return cursor.rowcount == 1
+
+    def is_finished(self, batch):
+        """
+        Returns whether no job in the batch is queued or leased.
+        """
+        row = self.connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE batch = ? AND status IN ('queued', 'leased')", (batch,)
+        ).fetchone()
+        return row[0] == 0
+
+    def stats(self, batch, stragglers=5):
+        """
+        Returns the batch's job counts by status, its wall time and throughput,
+        the distribution of job run and wait times, and its longest jobs.
+        """
+        rows = self.connection.execute(
+            "SELECT module, status, attempts, worker, enqueued_at, started_at, finished_at FROM jobs WHERE batch = ?",
+            (batch,),
+        ).fetchall()
+        counts = {}
+        for row in rows:
+            counts[row[1]] = counts.get(row[1], 0) + 1
+
+        finished = [row for row in rows if row[5] and row[6]]
+        stats = {"batch": batch, "jobs": len(rows), "counts": counts, "workers": len({row[3] for row in finished})}
+        if finished:
+            first_start = min(row[5] for row in finished)
+            last_finish = max(row[6] for row in finished)
+            seconds = sorted(row[6] - row[5] for row in finished)
+            stats.update(
+                {
+                    "wall_seconds": last_finish - first_start,
+                    "jobs_per_hour": len(finished) * 3600 / max(last_finish - first_start, 1),
+                    "job_seconds": {
+                        "median": statistics.median(seconds),
+                        "p90": seconds[int(0.9 * (len(seconds) - 1))],
+                        "max": seconds[-1],
+                        "total": sum(seconds),
+                    },
+                    "wait_seconds": {"median": statistics.median(row[5] - row[4] for row in finished)},
+                    # The time from the last job's start to the batch's end is the straggler tail.
+                    "tail_seconds": last_finish - max(row[5] for row in finished),
+                    "stragglers": [
+                        {"module": row[0], "seconds": row[6] - row[5], "attempts": row[2], "worker": row[3]}
+                        for row in sorted(finished, key=lambda row: row[6] - row[5], reverse=True)[:stragglers]
+                    ],
+                }
+            )
+        return stats
+
+
+class QueueRunner(Runner):
+    """
+    Runs jobs leased from a work queue, until no job in the batch is queued or
+    leased by another worker.
+    """
+
+    def __init__(self, queue, batch, lease_seconds=120, **kwargs):
+        super().__init__(**kwargs)
+        self.queue = queue
+        self.batch = batch
+        self.lease_seconds = lease_seconds
+        self.worker_id = "{}:{}".format(socket.gethostname(), os.getpid())
+        # Send heartbeats well before the lease expires.
+        self.poll_interval = lease_seconds / 4
+        self.last_heartbeat = 0
+
+    def run(self):
+        """
+        Yields the results of the jobs whose lease this worker still held when
+        they finished. Other results are left out of the node's report, so that
+        their output isn't merged.
+        """
+        for result in self._run():
+            if self.queue.complete(self.batch, result, self.worker_id):
+                yield result
+            else:
+                logger.warning("%s: lease lost before the job finished, ignoring its result", result["module"])
+
+    def _next_module(self):
+        return self.queue.lease(self.batch, self.worker_id, self.lease_seconds)
+
+    def _finished(self):
+        return self.queue.is_finished(self.batch)
+
+    def _tick(self, workers):
+        if time.time() - self.last_heartbeat < self.poll_interval:
+            return
+        self.last_heartbeat = time.time()
+        for worker in workers:
+            if not self.queue.heartbeat(self.batch, worker.module_name, self.worker_id, self.lease_seconds):
+                logger.warning("%s: lost lease, another worker may run it too", worker.module_name)